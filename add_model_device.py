@@ -29,9 +29,30 @@ Notes:
 # Adding model device and configuring it for first time deployment
 from pyFMG.fortimgr import *
 from modeldevice import *
+from dvmindex import DvmIndex
+from pipeline import run_devices, run_staged, run_fleet_delete, batch_steps, enabled_steps, RunContext, REMOVED
+from fleet import NOT_FOUND
+from tasktracker import TaskTracker
+from rpcbatch import RpcBatcher
+from inventory import iter_inventory_file, iter_devices, InventoryLoader, InventoryProfiles
+from timing import StepTimer, TimedApi
+from journal import StepJournal
+from reconcile import Reconciler
+from objcache import ObjectCache
+from snapshot import FmgSnapshot
+from planner import PlanApi, load_timings, measured_latencies, estimate, DEFAULT_CALL_LATENCY, DEFAULT_TASK_TIME
+from refcheck import ReferenceCheck, reference_report
+from transport import FmgTransport
+from ratelimit import AdaptiveLimiter
+from devexport import DeviceExport, DEFAULT_FIELDS
+from eventlog import EventLog, RUN_START, RUN_FINISH
+from contextlib import redirect_stdout, ExitStack
 import argparse
 import yaml
 import sys
+import os
+import json
+import time
 import urllib3
 from pprint import pprint
 
@@ -39,13 +60,103 @@ urllib3.disable_warnings()
 
 parser = argparse.ArgumentParser()
 parser.add_argument('--fgt_yaml', default='fgt.yml')
+parser.add_argument('--stream_inventory', type=bool, default=False)  # parse fgt_yaml one device at a time
+parser.add_argument('--profiles')  # yaml file of _defaults/_profiles settings shared by the devices of fgt_yaml
 parser.add_argument('--fmg_ip')
 parser.add_argument('--fmg_login', default='admin')
-parser.add_argument('--fmg_pass')
+parser.add_argument('--fmg_pass', default=os.environ.get('FMG_PASS'))  # or set FMG_PASS in the environment
 parser.add_argument('--fmg_ver', type=int, default=744)
 parser.add_argument('--api_debug', type=bool,  default=False)
+parser.add_argument('--fmg_http', type=bool, default=False)  # plain http instead of https (e.g. to fmgsim.py)
+parser.add_argument('--fmg_timeout', type=int, default=30)  # seconds to wait for each API response
+
+# Pooled keep-alive connections to FMG and retry of reads that fail on a connection error
+parser.add_argument('--transport', type=bool, default=False)
+parser.add_argument('--http_pool_size', type=int, default=10)  # set to at least --workers
+parser.add_argument('--get_retries', type=int, default=3)
+parser.add_argument('--retry_backoff', type=float, default=0.5)  # seconds, doubled per retry, with jitter
 parser.add_argument('--ignore_dev_exists', type=bool, default=False)
 
+# Bulk pre-flight: look up name/sn of all inventory devices up front instead of per-device DVM queries
+parser.add_argument('--bulk_preflight', type=bool, default=False)
+parser.add_argument('--preflight_chunk_size', type=int, default=0)  # 0 = pull entire DVM device list in one call
+
+# Check every group/template/package/variable the inventory references exists before anything is written
+parser.add_argument('--ref_check', type=bool, default=False)
+
+# Number of devices to run through the pipeline at the same time (each device still runs its steps in order)
+parser.add_argument('--workers', type=int, default=1)
+# Run the steps of a device that do not depend on each other at the same time (installs stay barriers)
+parser.add_argument('--parallel_steps', type=bool, default=False)
+
+# Batch mode: run each step across all devices, sending batch enabled steps to FMG for many devices per request
+parser.add_argument('--batch_install', type=bool, default=False)  # one Quick Install task per chunk of devices
+parser.add_argument('--batch_members', type=bool, default=False)  # one group/template/pkg member add per chunk
+parser.add_argument('--batch_meta_vars', type=bool, default=False)  # one mapping add per variable per chunk
+parser.add_argument('--batch_chunk_size', type=int, default=100)
+
+# Track all outstanding FMG tasks from one background poller instead of a blocking track_task loop per task
+parser.add_argument('--task_tracker', type=bool, default=False)
+parser.add_argument('--task_poll_min', type=float, default=1.0)
+parser.add_argument('--task_poll_max', type=float, default=10.0)
+parser.add_argument('--task_timeout', type=int, default=300)
+
+# Pack calls from concurrent devices into multi-param JSON-RPC requests (useful with --workers > 1)
+parser.add_argument('--rpc_batch', type=bool, default=False)
+parser.add_argument('--rpc_batch_size', type=int, default=20)  # max params per request
+parser.add_argument('--rpc_batch_wait', type=float, default=0.05)  # max seconds a call waits for others to join
+
+# Adapt the number of API calls in flight (AIMD) to FMG response latency, errors and outstanding task count
+parser.add_argument('--adaptive_limit', type=bool, default=False)
+parser.add_argument('--limit_initial', type=int, default=4)
+parser.add_argument('--limit_max', type=int, default=0)  # 0 = --workers
+parser.add_argument('--limit_target_latency', type=float, default=0.0)  # 0 = 3x the fastest response seen
+parser.add_argument('--limit_max_tasks', type=int, default=20)  # hold back new tasks while FMG has this many running
+parser.add_argument('--limit_task_wait', type=float, default=300)  # seconds a task start is held back at most
+
+# Time every step of every device and print p50/p95/max per step at the end, optionally save raw timings
+parser.add_argument('--timing', type=bool, default=False)
+parser.add_argument('--timing_out')  # path to write raw timings to, .csv for CSV otherwise JSON
+
+# Dry run: record the calls the run would make instead of sending them and print counts per step/target and the
+# estimated run time.  Reads still go to FMG (or to the --snapshot).
+parser.add_argument('--plan', type=bool, default=False)
+parser.add_argument('--plan_out')  # write every planned call (device, step, JSON-RPC params) as JSON lines
+parser.add_argument('--plan_timings')  # --timing_out file of an earlier run to take call/task latencies from
+parser.add_argument('--plan_call_latency', type=float, default=DEFAULT_CALL_LATENCY)  # seconds, if none measured
+parser.add_argument('--plan_task_time', type=float, default=DEFAULT_TASK_TIME)  # seconds, if none measured
+
+# Write {device name: true/false} for pipeline completion of every device as JSON (used by shard.py)
+parser.add_argument('--results_out')
+
+# JSON-lines event per device step (see eventlog.py), '-' for stdout in place of the progress output
+parser.add_argument('--event_log')
+parser.add_argument('--progress', type=bool, default=True)  # print per device progress output
+
+# Record completed steps per device in a SQLite journal, and with --resume skip the steps an earlier run completed
+parser.add_argument('--journal')  # path to the journal file
+parser.add_argument('--resume', type=bool, default=False)
+parser.add_argument('--journal_reset', type=bool, default=False)  # start over on a journal holding an earlier run
+
+# Read current group/template/package memberships once and only run the steps and installs that change something
+parser.add_argument('--reconcile', type=bool, default=False)
+
+# Cache GETs of ADOM objects (templates, groups, packages, scripts, variables) for the run, dropped on writes
+parser.add_argument('--object_cache', type=bool, default=False)
+parser.add_argument('--object_cache_ttl', type=float, default=300)  # seconds a cached object is used for
+
+# Keep the DVM name/sn index and the cached ADOM objects in a SQLite snapshot file and answer later runs from it
+parser.add_argument('--snapshot')  # path to the snapshot file, implies --object_cache
+parser.add_argument('--snapshot_max_age', type=float, default=3600)  # seconds before a part is read from FMG again
+
+# Delete every inventory device whose name and serial number match in FMG DVM, in bulk, instead of provisioning
+parser.add_argument('--fleet_delete', type=bool, default=False)
+
+# Write the DVM status of every inventory device to a file (.csv for CSV, otherwise JSON lines, '-' for stdout) and exit
+parser.add_argument('--export_devices')
+parser.add_argument('--export_fields', default=','.join(DEFAULT_FIELDS))  # comma separated dvmdb/device fields
+parser.add_argument('--export_page_size', type=int, default=500)  # device names looked up per request
+
 # Some testing/checking options
 parser.add_argument('--get_device_info', type=bool, default=True)
 parser.add_argument('--get_device_group_info', type=bool, default=False)
@@ -70,21 +181,29 @@ parser.add_argument('--add_to_pol_pkg', type=bool, default=False)
 parser.add_argument('--install_pol_pkg_to_db', type=bool, default=False)
 args = parser.parse_args()
 
-# Instantiate and Login to Fortimanager
-# api = pyfgt.fortimgr instance
-api = FortiManager(args.fmg_ip, args.fmg_login, args.fmg_pass, debug=args.api_debug, timeout=30, verify_ssl=False)
-
+if args.resume and not args.journal:
+    print('--resume needs the --journal file of the run to resume, aborting.')
+    sys.exit()
 
-def check_result(md_code, md_msg):
-    if md_msg == 'ABORT':
-        md_msg = '!!! Aborting configuration of this device.'
+# Read the latencies for the plan's estimate now, not after the whole plan has run
+plan_latencies = None
+if args.plan_timings:
+    try:
+        plan_latencies = measured_latencies(load_timings(args.plan_timings))
+    except OSError as e:
+        print(f'Cannot read --plan_timings file {args.plan_timings} ({e}), aborting.')
+        sys.exit()
+    except (ValueError, KeyError, TypeError) as e:
+        print(f'--plan_timings file {args.plan_timings} is not a --timing_out file ({e!r}), aborting.')
+        sys.exit()
 
-    if md_code == 0:
-        print('Success')
-        return True
-    else:
-        print(f'Failed: {md_msg}')
-        return False
+# Instantiate and Login to Fortimanager
+# api = pyfgt.fortimgr instance
+api = FortiManager(args.fmg_ip, args.fmg_login, args.fmg_pass, debug=args.api_debug, use_ssl=not args.fmg_http,
+                   timeout=args.fmg_timeout, verify_ssl=False)
+transport = None
+if args.transport:
+    transport = FmgTransport(api, args.http_pool_size, args.get_retries, args.retry_backoff)
 
 
 # Try to open HTTP(s)/JSON API connection to FMG
@@ -106,141 +225,302 @@ except FileNotFoundError:
     print(f'!!! Cannot find device yaml file at {args.fgt_yaml}, aborting !!!')
     sys.exit()
 else:
-    # load from yaml file to dict
-    devices = yaml.safe_load(f)
+    if args.stream_inventory or args.fgt_yaml.lower().endswith('.csv'):
+        # Devices are parsed one at a time as they are needed (see inventory.py)
+        devices = None
+    else:
+        # load from yaml file to dict
+        devices = yaml.load(f, Loader=InventoryLoader)
     f.close()
 
-for fg in devices:
-    print(f'<<<< Processing device: {fg} >>>>')
-    # Create class instance of ModelDevice for this fg device to be added
-    # We provide the device info as 'dict' and the logged in fntlib api
-    devices[fg]['name'] = fg   # assign name of device as var in dict
-    md = ModelDevice(devices[fg], api, args.fmg_ver)
-
-    if args.get_device_info:
-        print(f'  Get/print info for device {fg} if exists')
-        md.get_device_info()
-        pprint(md.get_device_info())
-        sys.exit()
-
-    if args.get_device_group_info:
-        print(f'   Get/print group info')
-        pprint(md.get_dev_group_info())
+# Settings shared by many devices, from --profiles and the _defaults/_profiles entries of fgt_yaml (see inventory.py)
+profiles = InventoryProfiles()
+if args.profiles:
+    try:
+        profiles.load(args.profiles)
+    except FileNotFoundError:
+        print(f'!!! Cannot find profiles yaml file at {args.profiles}, aborting !!!')
         sys.exit()
 
-    if args.delete_device:
-        print(f' Delete device: ', end='')
-        code, msg = md.delete()
-        check_result(code, msg)
 
-    if args.check_fmg_script:
-        print(f' Checking if script: {devices[fg]["fmg_script"]} exists')
-        pprint(md.check_fmg_script())
+# (name, device dict) pairs of the inventory, can be called again for another pass over the inventory
+def inventory():
+    if devices is None:
+        return iter_devices(iter_inventory_file(args.fgt_yaml), profiles)
+    return iter_devices(devices.items(), profiles)
+
+
+def inventory_model_devices():
+    for fg, device in inventory():
+        device['name'] = fg
+        yield ModelDevice(device, None, args.fmg_ver)
+
+
+# Reads made by a pre-run check, for its report.  With the object cache on the reads it answered (since it had
+# hits_before hits) are counted apart from the ones sent to FMG.
+def read_counts(reads, hits_before=0):
+    if object_cache is None:
+        return f'{reads} reads'
+    cached = object_cache.hits - hits_before
+    return f'{reads - cached} reads from FMG, {cached} from the object cache'
+
+# DVM index and ADOM objects from the snapshot of an earlier run, the DVM index read again if it is too old
+dvm_index = None
+snapshot = None
+if args.snapshot:
+    snapshot = FmgSnapshot(args.snapshot, args.fmg_ip, args.snapshot_max_age)
+    dvm_index = DvmIndex(api)
+    try:
+        refreshed = snapshot.load_index(dvm_index)
+    except MdFmgDvmError as e:
+        print(f'  {e}, aborting.')
+        api.logout()
+        sys.exit()
+    if refreshed:
+        print(f'<<<< Snapshot {args.snapshot}: DVM index read from FMG, {snapshot.dvm_changes} devices changed '
+              f'({len(dvm_index.sn_by_name)} in DVM) >>>>\n')
+    else:
+        print(f'<<<< Snapshot {args.snapshot}: DVM index of {len(dvm_index.sn_by_name)} devices from '
+              f'{snapshot.dvm_age():.0f} seconds ago >>>>\n')
+
+# Build DVM name/sn index for the whole inventory and report all conflicts before any device is processed
+if args.bulk_preflight:
+    print('<<<< Bulk pre-flight check of device names and serial numbers in FMG DVM >>>>')
+    names = []
+    serials = []
+    for fg, device in inventory():
+        names.append(fg)
+        serials.append(device.get('serial_num'))
+    if dvm_index is None:
+        dvm_index = DvmIndex(api, args.preflight_chunk_size)
+        try:
+            if args.preflight_chunk_size > 0:
+                dvm_index.load_for(names, serials)
+            else:
+                dvm_index.load()
+        except MdFmgDvmError as e:
+            print(f'  {e}, aborting.')
+            api.logout()
+            sys.exit()
+
+    conflicts = dvm_index.conflicts(inventory_model_devices())
+    if conflicts:
+        print(f'  {len(conflicts)} of {len(names)} devices have name/serial number conflicts:')
+        for fg in conflicts:
+            for problem in conflicts[fg]:
+                print(f'    {fg}: {problem}')
+    else:
+        print(f'  No name/serial number conflicts found for {len(names)} devices')
+    print()
+
+if args.export_devices:
+    fields = [f.strip() for f in args.export_fields.split(',') if f.strip()]
+    export = DeviceExport(api, fields, args.export_page_size)
+    start = time.perf_counter()
+    try:
+        written, found = export.write((fg for fg, device in inventory()), args.export_devices)
+    except MdFmgDvmError as e:
+        print(f'  {e}, aborting.')
+    else:
+        if args.export_devices != '-':
+            print(f'<<<< Exported {written} devices ({found} in FMG DVM) to {args.export_devices} with '
+                  f'{export.reads} requests in {time.perf_counter() - start:.1f} seconds >>>>')
+    api.logout()
+    sys.exit()
 
-    # Add model device to FMG
-    if args.add_model_device:
-        print(f'  Adding model device {fg}: ', end=' ')
+if args.get_device_info or args.get_device_group_info:
+    # Testing/checking options print info for the first device only and then exit
+    for fg, device in inventory():
+        print(f'<<<< Processing device: {fg} >>>>')
+        device['name'] = fg   # assign name of device as var in dict
+        md = ModelDevice(device, api, args.fmg_ver)
+
+        if args.get_device_info:
+            print(f'  Get/print info for device {fg} if exists')
+            pprint(md.get_device_info())
+            sys.exit()
+
+        if args.get_device_group_info:
+            print(f'   Get/print group info')
+            pprint(md.get_dev_group_info())
+            sys.exit()
+
+# API object the pipeline sends its requests through
+fmg = api if transport is None else transport
+
+# Plan mode records the calls instead (see planner.py), against the step running when each is made
+timer = None
+plan = None
+if args.plan:
+    timer = StepTimer()
+    plan_index = dvm_index
+    if plan_index is None:
+        # Only for answering the planned per device DVM lookups, the planned run still makes them
+        plan_index = DvmIndex(fmg)
         try:
-            code, msg = md.add()
-        # Catch exception from ModelDevice for if the sn or name already exists in FMG DVM and then handle
+            plan_index.load()
         except MdFmgDvmError as e:
-            if args.ignore_dev_exists:
-                print(f'\n    {e}, Continuing with configurations due to "ignore_dev_exists" flag set')
-            else:
-                print(f'\n    {e}, Abort further configuration of this device')
-                continue
-        # Catch exception from ModelDevice for if not enough variables provided to add device
-        except MdDataError as e:
-            print(f'\n    {e}, Aborting further configuration of this device')
-            continue
-        # No exceptions, so continue as normal
-        else:
-            if not check_result(code, 'ABORT'):
-                continue
-
-    if args.add_meta_vars_map and args.fmg_ver >= 720:
-        print(f'  Adding metadata variable mappings: ', end=' ')
-        code, msg = md.add_fmg_meta_vars_mapping()
-        if not check_result(code, 'ABORT'):
-            continue
-
-    # Add model device (already in DVM) to pre-run cli template
-    if args.add_to_pre_cli:
-        if 'pre_cli_template' in devices[fg]:
-            if devices[fg]['pre_cli_template'].lower() != 'none':
-                print(f'  Adding {fg} to pre-run CLI template \"'
-                        f'{devices[fg]["pre_cli_template"]}\": ', end=' ')
-                code, msg = md.add_to_pre_cli_script()
-                if not check_result(code, 'ABORT'):
-                    continue
-
-    # Install Device Settings (Quick DB Install)
-    if args.install_device_db_pre:
-        print(f'  Install (Quick Install) to Device DB for pre-run CLI template: ', end=' ')
-        code, msg = md.install_device_db()
-        if not check_result(code, 'ABORT'):
-            continue
-
-    # Assign model device to post-run CLI template group
-    if args.add_to_cli_templ_group:
-        print(f'  Add {fg} to CLI Template Group \"{devices[fg]["cli_template_group"]}\": ', end=' ')
-        code, msg = md.add_to_cli_templ_group()
-        if not check_result(code, 'ABORT'):
-            continue
-
-    # Install Device Settings (Quick DB Install)
-    if args.install_device_db_cli:
-        print(f'  Install (Quick Install) to Device DB for post-run CLI templates: ', end=' ')
-        code, msg = md.install_device_db()
-        if not check_result(code, 'ABORT'):
-            continue
-
-    # Add device to DVM Group
-    if args.add_to_dev_group:
-        print(f'  Add {fg} to FMG Device Group \"{devices[fg]["group"]}\": ', end=' ')
-        code, msg = md.add_to_dev_group()
-        if not check_result(code, 'ABORT'):
-            continue
-
-    # Add device to SDWAN Template
-    if args.add_to_sdwan_templ:
-        if 'sdwan_template' in devices[fg]:
-            if devices[fg]['sdwan_template'].lower() != 'none':
-                if "sdwan_template" in devices[fg]:
-                    print(f'  Add {fg} to SDWAN Template \"{devices[fg]["sdwan_template"]}\": ', end=' ')
-                    code, msg = md.add_to_sdwan_templ()
-                    if not check_result(code, 'ABORT'):
-                        continue
-                else:
-                    print(f'  sdwan_template parameter not provided, skipping add to sdwan-template')
-
-    # Assign model device to general template groups (not cli)
-    if args.add_to_templ_group:
-        print(f'  Add {fg} to Template Group \"{devices[fg]["template_group"]}\": ', end=' ')
-        code, msg = md.add_to_templ_group()
-        if not check_result(code, 'ABORT'):
-            continue
-
-    # Install Device Settings again, this time to add post run templates to DB
-    if args.install_device_db_post:
-        print(f'  Install (Quick Install) to Device DB for post-run CLI template/group: ', end=' ')
-        code, msg = md.install_device_db()
-        if not check_result(code, 'ABORT'):
-            continue
-
-    # Assign model device to a policy package (not totally needed with being in group, but prefer indiv option)
-    if args.add_to_pol_pkg:
-        print(f'  Add {fg} to Policy Package \"{devices[fg]["policy_package"]}\": ', end=' ')
-        code, msg = md.add_to_pol_pkg()
-        if not check_result(code, 'ABORT'):
-            continue
-
-    # Install Device Settings (hopefully this is quick DB install?)
-    if args.install_pol_pkg_to_db:
-        print(f'Install to DB Policy Package for device: ', end=' ')
-        code, msg = md.install_pol_pkg_to_db()
-        if not check_result(code, 'ABORT'):
-            continue
+            print(f'  {e}, aborting.')
+            api.logout()
+            sys.exit()
+    if snapshot is not None:
+        snapshot.dry_run = True
+    plan = PlanApi(fmg, timer, plan_index, args.plan_out)
+    fmg = plan
+    print('<<<< Plan mode: nothing is written to FMG >>>>\n')
+
+batcher = None
+if args.rpc_batch and plan is None:
+    batcher = RpcBatcher(fmg, args.rpc_batch_size, args.rpc_batch_wait)
+    fmg = batcher
+
+limiter = None
+if args.adaptive_limit and plan is None:
+    limit_max = args.limit_max if args.limit_max > 0 else max(args.workers, 1)
+    limiter = AdaptiveLimiter(fmg, args.limit_initial, max_limit=limit_max, target_latency=args.limit_target_latency,
+                              max_tasks=args.limit_max_tasks, task_wait=args.limit_task_wait).start()
+    fmg = limiter
+
+if (args.timing or args.timing_out) and plan is None:
+    timer = StepTimer()
+    fmg = TimedApi(fmg, timer)
+
+# Outside of the timer so that cache hits are not counted as API calls
+object_cache = None
+if args.object_cache or snapshot is not None:
+    object_cache = ObjectCache(fmg, args.object_cache_ttl, snapshot)
+    fmg = object_cache
+
+# Abort before any write if the inventory references groups/templates/packages/variables that do not exist
+if args.ref_check and not args.fleet_delete:
+    print('<<<< Checking groups, templates, packages and metadata variables referenced by the inventory >>>>')
+    ref_check = ReferenceCheck(fmg, args.fmg_ver)
+    hits = object_cache.hits if object_cache is not None else 0
+    missing = ref_check.check(inventory_model_devices(), [name for name, step in enabled_steps(args)])
+    if missing:
+        print(f'  {len(missing)} referenced objects not found ({read_counts(ref_check.reads, hits)}):')
+        for line in reference_report(missing):
+            print(f'    {line}')
+        print('  Fix the references (or disable the steps using them), aborting.')
+        api.logout()
+        sys.exit()
+    print(f'  All referenced objects found ({read_counts(ref_check.reads, hits)})\n')
+
+task_tracker = None
+if args.task_tracker and plan is None:
+    task_tracker = TaskTracker(fmg, args.task_poll_min, args.task_poll_max, timeout=args.task_timeout)
+journal = None
+if args.journal:
+    try:
+        journal = StepJournal(args.journal, resume=args.resume, read_only=plan is not None, reset=args.journal_reset)
+    except FileExistsError as e:
+        print(f'{e}, use --resume True to continue it or --journal_reset True to start over, aborting.')
+        sys.exit()
+    if args.resume:
+        print(f'<<<< Resuming from journal {args.journal}: {journal.devices()} devices have completed steps >>>>\n')
+reconciler = None
+if args.reconcile and not args.fleet_delete:
+    print('<<<< Reconcile: reading current device, membership and metadata variable state from FMG >>>>')
+    steps = [name for name, step in enabled_steps(args)]
+    hits = object_cache.hits if object_cache is not None else 0
+    reconciler = Reconciler(fmg, dvm_index, args.fmg_ver).load(inventory_model_devices(), steps)
+    changed, skipped = reconciler.summary(steps)
+    print(f'  {read_counts(reconciler.reads, hits)}, {changed} devices need changes, {skipped} device steps already '
+          f'in place\n')
+events = EventLog(args.event_log) if args.event_log else None
+ctx = RunContext(dvm_index, task_tracker, timer, journal, reconciler, events)
+if timer is not None and task_tracker is not None:
+    # Count the waits on the tracker against the step doing the waiting
+    ctx.task_tracker = TimedApi(task_tracker, timer)
+
+# Run the model device pipeline for every device, up to --workers devices at a time
+ctx.event(RUN_START, steps=[name for name, step in enabled_steps(args)], workers=args.workers)
+run_start = time.perf_counter()
+quiet = not args.progress or args.event_log == '-'
+with ExitStack() as output:
+    if quiet:
+        output.enter_context(redirect_stdout(output.enter_context(open(os.devnull, 'w'))))
+    if args.fleet_delete:
+        outcome = run_fleet_delete(inventory(), fmg, args, ctx)
+        results = {fg: status in (REMOVED, NOT_FOUND) for fg, (status, detail) in outcome.items()}
+    elif batch_steps(args):
+        results = run_staged(inventory(), fmg, args, args.workers, ctx)
+    else:
+        results = run_devices(inventory(), fmg, args, args.workers, ctx)
+ctx.event(RUN_FINISH, devices=len(results), completed=sum(results.values()),
+          duration=round(time.perf_counter() - run_start, 3))
+if events is not None:
+    events.close()
+if (args.workers > 1 or batch_steps(args)) and not args.fleet_delete:
+    print(f'\n<<<< Completed {sum(results.values())} of {len(results)} devices >>>>')
+if args.results_out:
+    with open(args.results_out, 'w') as f:
+        json.dump(results, f, indent=2)
+
+if task_tracker is not None:
+    task_tracker.stop()
+if journal is not None:
+    journal.close()
+if object_cache is not None:
+    print(f'<<<< Object cache: {object_cache.hits} hits, {object_cache.misses} misses >>>>')
+if snapshot is not None:
+    if plan is None:
+        # Devices the run added or deleted
+        snapshot.save_index(dvm_index)
+    snapshot.close()
+    print(f'<<<< Snapshot {args.snapshot}: {object_cache.stored} objects from earlier runs, '
+          f'{snapshot.dvm_changes} DVM devices changed by this run >>>>')
+if limiter is not None:
+    limiter.stop()
+    print(f'<<<< Adaptive limit: ended at {limiter.limit:.1f} calls in flight (low {limiter.low_limit:.1f}, peak '
+          f'{limiter.peak_limit:.1f}), {limiter.decreases} decreases, {limiter.waits} waits >>>>')
+    if limiter.task_wait_timeouts or limiter.failed_polls:
+        print(f'  {limiter.task_wait_timeouts} task starts let through after --limit_task_wait, '
+              f'{limiter.failed_polls} failed FMG task list reads at the end of the run')
+if transport is not None:
+    print(f'<<<< Connections: {transport.connections_opened} opened, {transport.connections_reused} requests on '
+          f'reused connections, {transport.retries} read retries >>>>')
+if batcher is not None:
+    batcher.stop()
+    print(f'<<<< Sent {batcher.calls_sent} API calls in {batcher.requests_sent} JSON-RPC requests >>>>')
+
+if plan is not None:
+    plan.close()
+    latencies = None
+    source = 'defaults'
+    if plan_latencies is not None:
+        latencies = plan_latencies
+        source = args.plan_timings
+    elif plan.reads_sent:
+        # No timings of an earlier run, every call is costed like the reads this plan sent
+        latencies = {None: (plan.read_time / plan.reads_sent, None)}
+        source = f'{plan.reads_sent} reads of this plan'
+    rows, serial, concurrent = estimate(plan, timer.records, args.workers, latencies, args.plan_call_latency,
+                                        args.plan_task_time)
+    reads = sum(row[2] for row in rows)
+    writes = sum(row[3] for row in rows)
+    print(f'\n<<<< Plan: {len(results)} devices, {reads + writes} API calls ({reads} reads, {writes} writes), '
+          f'{sum(row[4] for row in rows)} FMG tasks >>>>')
+    print(f'  {"step":<26} {"runs":>6} {"reads":>7} {"writes":>7} {"tasks":>6} {"est. seconds":>13}')
+    for step, runs, step_reads, step_writes, tasks, seconds in rows:
+        print(f'  {step:<26} {runs:>6} {step_reads:>7} {step_writes:>7} {tasks:>6} {seconds:>13.1f}')
+    print(f'\n  {"calls":>7} {"entries":>8}  target')
+    for (method, url), calls in plan.targets.most_common():
+        print(f'  {calls:>7} {plan.entries[(method, url)]:>8}  {method} {url}')
+    overall = (latencies or {}).get(None, (None, None))
+    per_call = overall[0] if overall[0] is not None else args.plan_call_latency
+    per_task = overall[1] if overall[1] is not None else args.plan_task_time
+    print(f'\n<<<< Estimated run time: {serial:.1f} seconds serial, {concurrent:.1f} seconds with {args.workers} '
+          f'workers ({per_call:.3f} s per call, {per_task:.1f} s per task, from {source}) >>>>')
+    if args.plan_out:
+        print(f'  Planned calls written to {args.plan_out}')
+
+if timer is not None and plan is None:
+    print('\n<<<< Step timing (seconds) >>>>')
+    print(timer.summary())
+    if args.timing_out:
+        timer.write(args.timing_out)
+        print(f'  Raw timings written to {args.timing_out}')
 
 
 api.logout()
@@ -0,0 +1,178 @@
+#! /usr/bin/python
+
+"""
+Throughput benchmark for add_model_device.py.
+
+Onboards synthetic fleets of model devices against the offline FMG simulator (fmgsim.py) and reports, per fleet
+size: devices completing every step (from the script's --results_out), devices per minute, JSON-RPC requests (and
+params entries) per device and the peak memory (RSS) of the add_model_device.py process.  Anything after '--' is passed through to add_model_device.py, so any combination of
+its options can be measured:
+
+    python bench_model_device.py --sizes 10,1000 --latency 0.02 -- --workers 8 --batch_install True
+
+Save a run with --out and compare a later one against it with --baseline to catch throughput regressions, the
+benchmark exits with 1 if devices/min for any fleet size dropped by more than --tolerance.
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import yaml
+from fmgsim import FmgSimulator
+
+SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'add_model_device.py')
+
+# ADOM objects referenced by the synthetic devices
+BENCH_OBJECTS = {
+    'pre_cli_template': '/pm/config/adom/root/obj/cli/template/bench_base',
+    'cli_template_group': '/pm/config/adom/root/obj/cli/template-group/bench_cli_group',
+    'group': '/dvmdb/adom/root/group/bench_branches',
+    'sdwan_template': '/pm/wanprof/adom/root/bench_sdwan',
+    'template_group': '/pm/tmplgrp/adom/root/bench_templ_group',
+    'policy_package': '/pm/pkg/adom/root/bench_pkg',
+}
+BENCH_VARIABLES = ('site_id', 'hostname')
+
+# Steps the synthetic devices are set up for that add_model_device.py leaves off by default.  Passed ahead of the
+# options after '--', which can turn them off again.
+BENCH_STEPS = ['--add_to_pol_pkg', 'True', '--install_pol_pkg_to_db', 'True']
+
+
+# Inventory of 'size' devices, same layout as fgt.yml
+def synthetic_fleet(size):
+    devices = {}
+    for i in range(size):
+        name = f'bench-fgt-{i:05d}'
+        devices[name] = {
+            'adom': 'root',
+            'vdom': 'root',
+            'user': 'admin',
+            'password': 'fortinet',
+            'descr': 'Benchmark model device',
+            'serial_num': f'FGVMBENCH{i:07d}',
+            'platform': 'FortiGate-VM64-KVM',
+            'preferred_img': '7.4.4-b2662',
+            'meta_vars': dict(zip(BENCH_VARIABLES, (str(i), name))),
+        }
+        for setting, url in BENCH_OBJECTS.items():
+            devices[name][setting] = url.rsplit('/', 1)[-1]
+    return devices
+
+
+# Onboard one synthetic fleet, returns dictionary of the measurements
+def run_fleet(size, args, script_args):
+    with tempfile.TemporaryDirectory() as tmp:
+        inventory = os.path.join(tmp, 'fgt.yml')
+        completion = os.path.join(tmp, 'results.json')
+        with open(inventory, 'w') as f:
+            yaml.safe_dump(synthetic_fleet(size), f, sort_keys=False)
+
+        with FmgSimulator(latency=args.latency, task_duration=args.task_duration, capacity=args.capacity) as sim:
+            for url in BENCH_OBJECTS.values():
+                sim.add_object(url)
+            for var in BENCH_VARIABLES:
+                sim.add_object(f'/pm/config/adom/root/obj/fmg/variable/{var}')
+            cmd = [sys.executable, SCRIPT, '--fgt_yaml', inventory, '--fmg_ip', sim.address, '--fmg_login', 'admin',
+                   '--fmg_pass', 'admin', '--fmg_http', 'True', '--get_device_info', ''] + BENCH_STEPS + script_args
+            # Last, so that it is the --results_out the script uses
+            cmd += ['--results_out', completion]
+
+            with open(args.log if args.log else os.devnull, 'a') as out:
+                start = time.perf_counter()
+                proc = subprocess.Popen(cmd, stdout=out, stderr=subprocess.STDOUT)
+                pid, status, rusage = os.wait4(proc.pid, 0)
+                elapsed = time.perf_counter() - start
+            proc.returncode = os.waitstatus_to_exitcode(status)
+
+            # Devices that made it through the whole pipeline, being in DVM does not mean every step worked
+            completed = {}
+            if os.path.exists(completion):
+                with open(completion) as f:
+                    completed = json.load(f)
+
+            # ru_maxrss is in KB on Linux and in bytes on macOS
+            peak_rss = rusage.ru_maxrss / 1024 if sys.platform != 'darwin' else rusage.ru_maxrss / 1024 / 1024
+            return {
+                'devices': size,
+                'onboarded': sum(1 for ok in completed.values() if ok),
+                'in_dvm': len(sim.devices),
+                'seconds': round(elapsed, 3),
+                'devices_per_min': round(size / elapsed * 60, 1),
+                'requests': sim.requests,
+                'calls': sim.calls,
+                'requests_per_device': round(sim.requests / size, 2),
+                'calls_per_device': round(sim.calls / size, 2),
+                'peak_rss_mb': round(peak_rss, 1),
+                'exit_code': proc.returncode,
+                'endpoints': {f'{method} {url}': n for (method, url), n in sim.call_counts.most_common()},
+            }
+
+
+def print_results(results):
+    print(f'  {"devices":>8} {"onboarded":>10} {"seconds":>9} {"dev/min":>9} {"req/dev":>8} {"calls/dev":>10} '
+          f'{"peak MB":>8}')
+    for r in results:
+        print(f'  {r["devices"]:>8} {r["onboarded"]:>10} {r["seconds"]:>9.2f} {r["devices_per_min"]:>9.1f} '
+              f'{r["requests_per_device"]:>8.2f} {r["calls_per_device"]:>10.2f} {r["peak_rss_mb"]:>8.1f}')
+
+
+# List of regression messages for fleet sizes whose devices/min dropped more than 'tolerance' below the baseline
+def regressions(results, baseline, tolerance):
+    before = {r['devices']: r for r in baseline}
+    problems = []
+    for r in results:
+        if r['devices'] not in before:
+            continue
+        old = before[r['devices']]['devices_per_min']
+        if r['devices_per_min'] < old * (1 - tolerance):
+            problems.append(f'{r["devices"]} devices: {r["devices_per_min"]} devices/min, baseline {old}')
+    return problems
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', default='10,1000,10000')  # comma separated fleet sizes
+    parser.add_argument('--latency', type=float, default=0.0)  # seconds added to every simulated request
+    parser.add_argument('--task_duration', type=float, default=0.0)  # seconds each simulated task takes
+    parser.add_argument('--capacity', type=int, default=0)  # concurrent requests before simulated latency grows
+    parser.add_argument('--endpoints', type=bool, default=False)  # print calls per endpoint for each fleet
+    parser.add_argument('--log')  # append add_model_device.py output to this file
+    parser.add_argument('--out')  # write results as JSON
+    parser.add_argument('--baseline')  # JSON results of an earlier run to compare devices/min against
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    args, script_args = parser.parse_known_args()
+    script_args = [a for a in script_args if a != '--']
+
+    results = []
+    for size in [int(s) for s in args.sizes.split(',') if s.strip()]:
+        print(f'<<<< Onboarding {size} synthetic devices >>>>')
+        result = run_fleet(size, args, script_args)
+        results.append(result)
+        if result['exit_code'] != 0 or result['onboarded'] != size:
+            print(f'  add_model_device.py exited with {result["exit_code"]}, {result["onboarded"]} of {size} devices '
+                  f'completed ({result["in_dvm"]} in DVM)')
+        if args.endpoints:
+            for endpoint, calls in result['endpoints'].items():
+                print(f'    {calls:>8}  {endpoint}')
+
+    print('\n<<<< Benchmark results >>>>')
+    print_results(results)
+
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f'  Results written to {args.out}')
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            problems = regressions(results, json.load(f), args.tolerance)
+        if problems:
+            print(f'\n<<<< Throughput regression (more than {args.tolerance:.0%} below baseline) >>>>')
+            for problem in problems:
+                print(f'  {problem}')
+            sys.exit(1)
+        print('  No throughput regression against baseline')
@@ -0,0 +1,83 @@
+import csv
+import json
+import sys
+from modeldevice import MdFmgDvmError
+
+# dvmdb/device fields exported when none are asked for
+DEFAULT_FIELDS = ('sn', 'platform_str', 'os_ver', 'conf_status', 'db_status', 'conn_status', 'dev_status')
+
+
+# Status export of the inventory's devices from FMG DVM.  The inventory names are read in pages of page_size and
+# each page is looked up with one 'in' filtered dvmdb/device GET returning only the requested fields, so a fleet
+# costs one request per page instead of one per device, and rows are written out page by page as they arrive.
+class DeviceExport:
+    def __init__(self, fmg_api=None, fields=DEFAULT_FIELDS, page_size: int = 500):
+        self.api = fmg_api
+        self.fields = [f for f in fields if f != 'name']
+        self.page_size = page_size if page_size > 0 else 500
+        self.reads = 0
+
+    # Columns of every record
+    @property
+    def columns(self):
+        return ['name', 'in_fmg'] + self.fields
+
+    # One record per passed in device name, in the same order, with in_fmg False (and the fields empty) for names
+    # not found in DVM.  Raises MdFmgDvmError if a page cannot be read.
+    def records(self, names):
+        page = []
+        for name in names:
+            page.append(name)
+            if len(page) >= self.page_size:
+                yield from self._page(page)
+                page = []
+        if page:
+            yield from self._page(page)
+
+    def _page(self, names):
+        url = 'dvmdb/device/'
+        data = {
+            'filter': ['name', 'in', *names],
+            'fields': ['name', *self.fields],
+            'range': [0, len(names)]
+        }
+        self.reads += 1
+        rcode, rmsg = self.api.get(url, data)
+        if rcode != 0:
+            raise MdFmgDvmError(f'Unable to retrieve device list from FMG DVM: {rmsg}')
+        # FMG returns a dict rather than a list when exactly one object matches some queries
+        if isinstance(rmsg, dict):
+            rmsg = [rmsg]
+        found = {rec.get('name'): rec for rec in rmsg or []}
+
+        for name in names:
+            rec = found.get(name)
+            record = {'name': name, 'in_fmg': rec is not None}
+            for field in self.fields:
+                record[field] = rec.get(field) if rec is not None else None
+            yield record
+
+    # Write the records of the passed in device names to path, as CSV if it ends with .csv otherwise as JSON lines
+    # ('-' for JSON lines on stdout).  Returns (records written, records found in DVM).
+    def write(self, names, path):
+        if path == '-':
+            return self._write(names, sys.stdout, False)
+        with open(path, 'w', newline='', encoding='utf-8') as f:
+            return self._write(names, f, path.lower().endswith('.csv'))
+
+    def _write(self, names, f, as_csv):
+        written = 0
+        found = 0
+        writer = None
+        if as_csv:
+            writer = csv.DictWriter(f, fieldnames=self.columns)
+            writer.writeheader()
+        for record in self.records(names):
+            if writer is not None:
+                # Nested values (lists/dicts) are written as JSON in their cell
+                writer.writerow({k: json.dumps(v) if isinstance(v, (list, dict)) else v for k, v in record.items()})
+            else:
+                f.write(json.dumps(record) + '\n')
+            written += 1
+            found += record['in_fmg']
+        return written, found
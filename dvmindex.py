@@ -0,0 +1,117 @@
+from modeldevice import MdFmgDvmError
+
+
+# In-memory index of FMG DVM device names and serial numbers.  Built with one bulk 'dvmdb/device' query (or one
+# 'in' filtered query per chunk of names/serials) so that ModelDevice objects can answer their name/sn existence
+# checks locally instead of sending a filtered GET per device.
+class DvmIndex:
+    def __init__(self, fmg_api=None, chunk_size: int = 0):
+        self.api = fmg_api
+        # chunk_size of 0 means pull name/sn of every device in DVM with a single request
+        self.chunk_size = chunk_size
+        self.sn_by_name = {}
+        self.name_by_sn = {}
+        self.loaded = False
+
+    # Pull name/sn for every device in FMG DVM with a single request
+    def load(self):
+        url = 'dvmdb/device/'
+        data = {
+            'fields': ['name', 'sn']
+        }
+        rcode, rmsg = self.api.get(url, data)
+        if rcode != 0:
+            raise MdFmgDvmError(f'Unable to retrieve device list from FMG DVM: {rmsg}')
+
+        self._add_records(rmsg)
+        self.loaded = True
+        return self
+
+    # Pull name/sn only for devices matching the passed in names or serial numbers, one request per chunk
+    def load_for(self, names, serials):
+        names = [n for n in names if n is not None]
+        serials = [s for s in serials if s is not None]
+        size = self.chunk_size if self.chunk_size > 0 else max(len(names), len(serials), 1)
+
+        url = 'dvmdb/device/'
+        for i in range(0, max(len(names), len(serials)), size):
+            name_chunk = names[i:i + size]
+            sn_chunk = serials[i:i + size]
+
+            data_filter = []
+            if name_chunk:
+                data_filter.append(['name', 'in', *name_chunk])
+            if sn_chunk:
+                if data_filter:
+                    data_filter.append('||')
+                data_filter.append(['sn', 'in', *sn_chunk])
+
+            data = {
+                'filter': data_filter,
+                'fields': ['name', 'sn']
+            }
+            rcode, rmsg = self.api.get(url, data)
+            if rcode != 0:
+                raise MdFmgDvmError(f'Unable to retrieve device list from FMG DVM: {rmsg}')
+            self._add_records(rmsg)
+
+        self.loaded = True
+        return self
+
+    def _add_records(self, records):
+        # FMG returns a dict rather than a list when exactly one object matches some queries
+        if isinstance(records, dict):
+            records = [records]
+        for rec in records or []:
+            self.add_device(rec.get('name'), rec.get('sn'))
+
+    # Keep the index current after the tool itself adds or removes a device
+    def add_device(self, name, sn):
+        if name is not None:
+            self.sn_by_name[name] = sn
+        if sn is not None:
+            self.name_by_sn[sn] = name
+
+    def remove_device(self, name):
+        sn = self.sn_by_name.pop(name, None)
+        if sn is not None and self.name_by_sn.get(sn) == name:
+            del self.name_by_sn[sn]
+
+    def name_exists(self, name):
+        return name in self.sn_by_name
+
+    def sn_exists(self, sn):
+        return sn in self.name_by_sn
+
+    # Return True if the name exists in DVM and is associated to the passed in serial number
+    def name_and_sn_same(self, name, sn):
+        return self.sn_by_name.get(name) == sn
+
+    # Build a report of every name and serial number conflict for the passed in ModelDevice objects.  Returns a
+    # dictionary keyed by device name with a list of conflict messages for each device that has at least one.
+    def conflicts(self, mds):
+        report = {}
+        seen_names = {}
+        seen_sns = {}
+        for md in mds:
+            problems = []
+            if md.name is not None and self.name_exists(md.name):
+                problems.append(f'Device with name {md.name} already exists in FMG DVM '
+                                f'(sn: {self.sn_by_name[md.name]})')
+            if md.serial_num is not None and self.sn_exists(md.serial_num):
+                problems.append(f'Device with serial number {md.serial_num} already exists in FMG DVM '
+                                f'(name: {self.name_by_sn[md.serial_num]})')
+
+            # Conflicts inside the inventory itself would also fail once the first of the pair is added
+            if md.name in seen_names:
+                problems.append(f'Device name {md.name} is used more than once in the inventory')
+            if md.serial_num is not None and md.serial_num in seen_sns:
+                problems.append(f'Serial number {md.serial_num} is also used by {seen_sns[md.serial_num]} '
+                                f'in the inventory')
+            seen_names[md.name] = True
+            if md.serial_num is not None:
+                seen_sns.setdefault(md.serial_num, md.name)
+
+            if problems:
+                report[md.name] = problems
+        return report
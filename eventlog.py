@@ -0,0 +1,178 @@
+#! /usr/bin/python
+
+"""
+Structured event log of an add_model_device.py run, and a renderer for it.
+
+add_model_device.py --event_log writes one JSON record per line for each step a device starts, finishes or skips
+(with the duration, result code and FMG message), each metadata variable mapping and the start and end of the run.
+Records are handed to a background thread that writes them out in blocks, so the workers never wait on the file or
+terminal.  This script turns such a stream back into readable progress output, from a file or from stdin:
+
+    python add_model_device.py --event_log - ... | python eventlog.py
+    python eventlog.py events.jsonl --device fg-branch-001
+    python eventlog.py events.jsonl --follow
+"""
+
+import argparse
+import json
+import queue
+import sys
+import threading
+import time
+
+# Event names
+RUN_START = 'run_start'
+RUN_FINISH = 'run_finish'
+STEP_START = 'step_start'
+STEP_FINISH = 'step_finish'
+STEP_SKIP = 'step_skip'
+DEVICE_ERROR = 'device_error'
+META_VAR = 'meta_var'
+
+
+# JSON-lines event writer.  'output' is a file path, or '-' (or any object with write()) for a stream.  emit() only
+# queues the record, a background thread serializes and writes whatever has queued up since its last write and
+# flushes, so the output is never more than flush_interval seconds behind.  Up to buffer_size records are queued
+# before emit() waits for the writer.
+class EventLog:
+    def __init__(self, output='-', buffer_size: int = 10000, flush_interval: float = 0.5):
+        if output == '-':
+            self.stream = sys.stdout
+            self._close_stream = False
+        elif isinstance(output, str):
+            self.stream = open(output, 'a', encoding='utf-8')
+            self._close_stream = True
+        else:
+            self.stream = output
+            self._close_stream = False
+        self.flush_interval = flush_interval
+        self._queue = queue.Queue(maxsize=buffer_size)
+        self._thread = threading.Thread(target=self._run, name='event-log-writer', daemon=True)
+        self._thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def emit(self, event, **fields):
+        record = {'ts': round(time.time(), 3), 'event': event}
+        record.update(fields)
+        self._queue.put(record)
+
+    def step_start(self, device, step, **fields):
+        self.emit(STEP_START, device=device, step=step, **fields)
+
+    def step_finish(self, device, step, ok, duration, code=None, msg=None):
+        self.emit(STEP_FINISH, device=device, step=step, ok=bool(ok), duration=round(duration, 3), code=code,
+                  msg=msg)
+
+    # Write out everything emitted so far and stop the writer
+    def close(self):
+        if self._thread is None:
+            return
+        self._queue.put(None)
+        self._thread.join()
+        self._thread = None
+        if self._close_stream:
+            self.stream.close()
+
+    def _run(self):
+        while True:
+            records = [self._queue.get()]
+            deadline = time.monotonic() + self.flush_interval
+            # Collect whatever else arrives before the deadline into the same write
+            while records[-1] is not None:
+                try:
+                    records.append(self._queue.get(timeout=max(deadline - time.monotonic(), 0)))
+                except queue.Empty:
+                    break
+            done = records[-1] is None
+            if done:
+                records.pop()
+            if records:
+                self.stream.write(''.join(json.dumps(r, default=str) + '\n' for r in records))
+                self.stream.flush()
+            if done:
+                return
+
+
+# Readable line for an event record, None for records that are not shown
+def render(record):
+    event = record.get('event')
+    device = record.get('device')
+    step = record.get('step')
+    if event == RUN_START:
+        steps = ', '.join(record.get('steps', []))
+        return f'<<<< Onboarding with {record.get("workers")} workers, steps: {steps} >>>>'
+    if event == RUN_FINISH:
+        return (f'<<<< {record.get("completed")} of {record.get("devices")} devices completed in '
+                f'{record.get("duration", 0):.1f} seconds >>>>')
+    if event == STEP_START:
+        if device is None:
+            return f'<<<< Step {step} for {record.get("devices")} devices >>>>'
+        return None
+    if event == STEP_FINISH:
+        result = 'Success' if record.get('ok') else f'Failed: {_message(record)}'
+        return f'  {device}: {step}: {result} ({record.get("duration", 0):.2f}s)'
+    if event == STEP_SKIP:
+        return f'  {device}: {step}: skipped, {record.get("reason")}'
+    if event == DEVICE_ERROR:
+        return f'  {device}: {record.get("msg")}, Aborting configuration of this device'
+    if event == META_VAR:
+        if record.get('code') == 0:
+            return None
+        return f'  {device}: metadata variable {record.get("var")}: Failed: {_message(record)}'
+    return f'  {event}: {json.dumps({k: v for k, v in record.items() if k not in ("ts", "event")}, default=str)}'
+
+
+def _message(record):
+    msg = record.get('msg')
+    if msg is None:
+        return f'code {record.get("code")}'
+    return msg if isinstance(msg, str) else json.dumps(msg, default=str)
+
+
+# Records of a JSON-lines stream, with follow=True keep waiting for more lines at the end of the file
+def read_events(stream, follow=False):
+    while True:
+        line = stream.readline()
+        if not line:
+            if not follow:
+                return
+            time.sleep(0.5)
+            continue
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError:
+            # Not an event (output of the script mixed into the stream), passed through as is
+            yield {'event': None, 'text': line}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('events', nargs='?', default='-')  # event log file, '-' for stdin
+    parser.add_argument('--follow', type=bool, default=False)  # keep reading as the file grows
+    parser.add_argument('--device')  # only show events of this device
+    args = parser.parse_args()
+
+    stream = sys.stdin if args.events == '-' else open(args.events, encoding='utf-8')
+    try:
+        for record in read_events(stream, args.follow):
+            if record.get('event') is None:
+                print(record['text'])
+                continue
+            if args.device is not None and record.get('device') != args.device:
+                continue
+            line = render(record)
+            if line is not None:
+                print(line, flush=True)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if stream is not sys.stdin:
+            stream.close()
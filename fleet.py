@@ -0,0 +1,260 @@
+from modeldevice import *
+from dvmindex import DvmIndex
+
+# Ownership of a device name in FMG DVM (see ModelDeviceFleet.ownership)
+OWNED = 'owned'  # name is in DVM with the device's serial number
+NOT_FOUND = 'not_found'  # name is not in DVM
+SN_MISMATCH = 'sn_mismatch'  # name is in DVM with another serial number
+NO_SERIAL = 'no_serial'  # device has no serial number to check the DVM entry against
+
+
+# Fleet level counterpart to ModelDevice.  Runs operations that FMG can accept for many devices at once (multi-entry
+# 'scope' lists etc.) so that N devices cost a handful of requests/tasks instead of N of them.  Methods return a
+# dictionary of device name to the same (code, msg) tuple the matching ModelDevice method would have returned.
+class ModelDeviceFleet:
+    def __init__(self, mds: list = None, fmg_api=None, chunk_size: int = 100, params_per_request: int = 10):
+        self.mds = mds if mds is not None else []
+        self.chunk_size = chunk_size if chunk_size > 0 else 100
+        # Max number of JSON-RPC 'params' entries packed into one request where multi-param requests are used
+        self.params_per_request = params_per_request if params_per_request > 0 else 10
+        # Optional TaskTracker (see tasktracker.py), lets the tasks for all chunks be waited on together
+        self.task_tracker = None
+        # Optional loaded DvmIndex (see dvmindex.py), used for ownership checks instead of reading DVM
+        self.dvm_index = None
+        if fmg_api is not None: self.api = fmg_api
+
+    @property
+    def api(self):
+        return self._api
+
+    @api.setter
+    def api(self, myapi):
+        self._api = myapi
+
+    # Split the devices into chunks of chunk_size, never mixing ADOMs in one chunk
+    def _chunks(self, mds):
+        by_adom = {}
+        for md in mds:
+            by_adom.setdefault(md.adom, []).append(md)
+        for adom, adom_mds in by_adom.items():
+            for i in range(0, len(adom_mds), self.chunk_size):
+                yield adom, adom_mds[i:i + self.chunk_size]
+
+    # Wait for the tasks started for each chunk of devices and map each task line back to the device it is for.
+    # 'started' is a list of (chunk of ModelDevice, code, msg) for the requests that started the tasks.
+    def _api_task_results(self, started):
+        # With a task tracker all of the tasks are tracked at the same time, otherwise one after the other
+        futures = {}
+        if self.task_tracker is not None:
+            for i, (mds, code, msg) in enumerate(started):
+                taskid = self._taskid(code, msg)
+                if taskid is not None:
+                    futures[i] = self.task_tracker.submit(taskid)
+
+        results = {}
+        for i, (mds, code, msg) in enumerate(started):
+            if code != 0:
+                results.update({md.name: (1, msg) for md in mds})
+                continue
+
+            taskid = self._taskid(code, msg)
+            if taskid is None:
+                # No error and no task, success
+                results.update({md.name: (0, None) for md in mds})
+                continue
+
+            tcode, task = futures[i].result() if i in futures else self.api.track_task(taskid)
+            results.update(self._task_line_results(mds, tcode, task))
+        return results
+
+    @staticmethod
+    def _taskid(code, msg):
+        if code != 0 or not isinstance(msg, dict):
+            return None
+        return msg.get('taskid', msg.get('task'))
+
+    @staticmethod
+    def _task_line_results(mds, tcode, task):
+        if tcode != 0 or 'line' not in task:
+            return {md.name: (1, task) for md in mds}
+
+        lines = {}
+        for line in task['line']:
+            lines[line.get('name')] = line
+
+        results = {}
+        for md in mds:
+            line = lines.get(md.name)
+            if line is not None:
+                results[md.name] = (1, line) if line.get('err', 0) != 0 else (0, None)
+            elif task['num_err'] > 0 or task['num_warn'] > 0:
+                # Task reported problems but no line for this device, treat the same as ModelDevice does
+                results[md.name] = (1, task['line'][-1] if task['line'] else task)
+            else:
+                results[md.name] = (0, None)
+        return results
+
+    # Quick install settings to the device DB for every device, one task per chunk of devices
+    def install_device_db(self, mds: list = None):
+        mds = self.mds if mds is None else mds
+        for md in mds:
+            if md.adom is None: raise MdDataError('adom', 'install_device_db')
+            if md.vdom is None: raise MdDataError('vdom', 'install_device_db')
+            if md.name is None: raise MdDataError('name', 'install_device_db')
+
+        # Start the install task for every chunk first, then wait on all of them
+        started = []
+        for adom, chunk in self._chunks(mds):
+            url = f'/securityconsole/install/device'
+            data = {
+                "adom": adom,
+                "scope": [{"name": md.name, "vdom": md.vdom} for md in chunk]
+            }
+            rcode, rmsg = self.api.execute(url, data=data)
+            started.append((chunk, rcode, rmsg))
+        return self._api_task_results(started)
+
+    # Check for every device whether its name is in FMG DVM with its serial number, with one 'in' filtered read of
+    # DVM for all of the names.  Returns dictionary of device name to (OWNED, NOT_FOUND, SN_MISMATCH or NO_SERIAL,
+    # serial number of the name in DVM).
+    def ownership(self, mds: list = None):
+        mds = self.mds if mds is None else mds
+        for md in mds:
+            if md.name is None: raise MdDataError('name', 'delete')
+
+        # Always read from FMG, never from the fleet's index: that may come from a snapshot (--snapshot) older than a
+        # re-registration of one of the names, and the result decides what gets deleted
+        index = DvmIndex(self.api).load_for([md.name for md in mds], [])
+
+        results = {}
+        for md in mds:
+            sn = index.sn_by_name.get(md.name)
+            if not index.name_exists(md.name):
+                results[md.name] = (NOT_FOUND, None)
+            elif md.serial_num is None:
+                results[md.name] = (NO_SERIAL, sn)
+            elif sn != md.serial_num:
+                results[md.name] = (SN_MISMATCH, sn)
+            else:
+                results[md.name] = (OWNED, sn)
+        return results
+
+    # Delete every device from FMG DVM with one 'dvm/cmd/del/dev-list' task per chunk of devices, tracked together.
+    # No ownership check is done here, see ownership().
+    def delete(self, mds: list = None):
+        mds = self.mds if mds is None else mds
+        for md in mds:
+            if md.adom is None: raise MdDataError('adom', 'delete')
+            if md.name is None: raise MdDataError('name', 'delete')
+
+        # Start the delete task for every chunk first, then wait on all of them
+        started = []
+        for adom, chunk in self._chunks(mds):
+            url = 'dvm/cmd/del/dev-list'
+            data = {
+                'adom': adom,
+                'flags': ['create_task', 'nonblocking'],
+                'del-dev-member-list': [{'name': md.name} for md in chunk]
+            }
+            rcode, rmsg = self.api.execute(url, data=data)
+            started.append((chunk, rcode, rmsg))
+        results = self._api_task_results(started)
+
+        if self.dvm_index is not None:
+            for name, (code, msg) in results.items():
+                if code == 0:
+                    self.dvm_index.remove_device(name)
+        return results
+
+    # Add every device to the scope of the object targeted by the passed in add_to_* method (see
+    # SCOPE_MEMBER_TARGETS in modeldevice.py).  Memberships are grouped by target object and sent as one multi-member
+    # add per chunk of devices.  If a chunk is rejected, its members are retried one at a time so that the failure is
+    # reported against the device(s) that caused it and not the whole chunk.
+    def add_scope_members(self, method, mds: list = None):
+        mds = self.mds if mds is None else mds
+        target = SCOPE_MEMBER_TARGETS[method]
+        for md in mds:
+            if md.adom is None: raise MdDataError('adom', method)
+            if md.vdom is None: raise MdDataError('vdom', method)
+            if md.name is None: raise MdDataError('name', method)
+            if getattr(md, target) is None: raise MdDataError(target, method)
+
+        by_url = {}
+        for md in mds:
+            url, member = md.scope_member(method)
+            by_url.setdefault(url, []).append((md, member))
+
+        results = {}
+        for url, members in by_url.items():
+            for i in range(0, len(members), self.chunk_size):
+                chunk = members[i:i + self.chunk_size]
+                rcode, rmsg = self.api.add(url, data=[member for md, member in chunk])
+                if rcode == 0:
+                    results.update({md.name: (0, None) for md, member in chunk})
+                elif len(chunk) == 1:
+                    results[chunk[0][0].name] = (1, rmsg)
+                else:
+                    for md, member in chunk:
+                        rcode, rmsg = self.api.add(url, data=member)
+                        results[md.name] = (0, None) if rcode == 0 else (1, rmsg)
+        return results
+
+    # FMG 7.2+ metadata variables.  Add the dynamic mapping of every device for each variable, grouping the mappings by
+    # variable so that each variable gets one add per chunk of devices, and packing the adds for several variables into
+    # one multi-param JSON-RPC request.  Returns dictionary of device name to (0, None) or to (1, failed) where failed
+    # is a dictionary of variable name to the FMG error for each of that device's mappings that failed.
+    def add_fmg_meta_vars_mapping(self, mds: list = None):
+        mds = self.mds if mds is None else mds
+        for md in mds:
+            if md.adom is None: raise MdDataError('adom', 'add_fmg_meta_vars_mapping')
+            if md.name is None: raise MdDataError('name', 'add_fmg_meta_vars_mapping')
+
+        by_url = {}
+        for md in mds:
+            if not md.meta_vars:
+                continue
+            for var in md.meta_vars:
+                url = f'/pm/config/adom/{md.adom}/obj/fmg/variable/{var}/dynamic_mapping'
+                entry = {
+                    "_scope": {
+                        "name": f"{md.name}",
+                        "vdom": f"global"
+                    },
+                    "value": f"{md.meta_vars[var]}"
+                }
+                by_url.setdefault(url, (var, []))[1].append((md, entry))
+
+        # One params entry per chunk of mappings for a variable
+        params = []
+        for url, (var, mappings) in by_url.items():
+            for i in range(0, len(mappings), self.chunk_size):
+                params.append((url, var, mappings[i:i + self.chunk_size]))
+
+        failed = {}
+        for i in range(0, len(params), self.params_per_request):
+            batch = params[i:i + self.params_per_request]
+            rcode, rmsg = self.api.free_form('add', data=[
+                {'url': url, 'data': [entry for md, entry in mappings]} for url, var, mappings in batch
+            ])
+
+            for n, (url, var, mappings) in enumerate(batch):
+                status = self._free_form_status(rcode, rmsg, n)
+                if status['code'] == 0:
+                    continue
+                if len(mappings) == 1:
+                    failed.setdefault(mappings[0][0].name, {})[var] = status
+                    continue
+                # Retry the chunk's mappings one at a time to find which devices were rejected
+                for md, entry in mappings:
+                    code, msg = self.api.add(url, data=entry)
+                    if code != 0:
+                        failed.setdefault(md.name, {})[var] = msg.get('status', msg) if isinstance(msg, dict) else msg
+
+        return {md.name: (1, failed[md.name]) if md.name in failed else (0, None) for md in mds}
+
+    # Status of the n'th params entry of a free_form (multi-param) request
+    @staticmethod
+    def _free_form_status(rcode, rmsg, n):
+        if rcode != 200 or not isinstance(rmsg, list) or n >= len(rmsg):
+            return {'code': 1, 'message': f'Request failed: {rmsg}'}
+        return rmsg[n].get('status', {'code': 1, 'message': 'No status returned'})
@@ -0,0 +1,384 @@
+#! /usr/bin/python
+
+"""
+Offline FortiManager JSON-RPC simulator.
+
+Implements (loosely) the parts of the FMG JSON-RPC API that ModelDevice and add_model_device.py use, so that the
+provisioning pipeline can be run and measured without a live FortiManager:
+    - sys/login/user, sys/logout and /cli/global/system/global (pyFMG login)
+    - dvmdb/device (filter/fields/range), dvm/cmd/add/device, dvm/cmd/del/device, dvm/cmd/del/dev-list
+    - 'scope member' / 'object member' adds and gets, metadata variable dynamic_mapping adds
+    - /securityconsole/install/device and /securityconsole/install/package
+    - task tracking (/task/task and /task/task/<id>)
+Multi-param requests are supported, params the simulator cannot handle get an error status.  A device's db_status is
+'mod' (2) after a member add for it and 'nomod' (1) after an install.  Every HTTP request waits 'latency' seconds and
+every task takes 'task_duration' seconds to reach 100%.  With 'capacity' set, the latency grows with the square of the
+load once more than that many requests are being handled at the same time, so like an overloaded FMG total throughput
+drops when pushed harder.
+
+Run standalone:  python fmgsim.py --port 8080 --latency 0.05 --task_duration 2
+then point add_model_device.py at it with --fmg_ip 127.0.0.1:8080 --fmg_http True
+"""
+
+import argparse
+import itertools
+import json
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class FmgSimulator:
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, latency: float = 0.0, task_duration: float = 0.0,
+                 strict_objects: bool = False, capacity: int = 0):
+        self.latency = latency
+        self.task_duration = task_duration
+        self.capacity = capacity
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        # With strict_objects, adds to a group/template/package not in self.objects fail like they would on FMG
+        self.strict_objects = strict_objects
+        self.devices = {}  # device name -> dvmdb device record
+        self._name_by_sn = {}
+        self.objects = {}  # url -> object data, for gets of adom objects (templates, groups, scripts...)
+        self.members = {}  # scope/object member url -> list of member entries
+        self.tasks = {}
+        self.requests = 0  # HTTP requests
+        self.calls = 0  # JSON-RPC params entries
+        self.call_counts = Counter()  # (method, url pattern) -> calls
+        self._lock = threading.RLock()
+        self._task_ids = itertools.count(1)
+        self._oids = itertools.count(100)
+        self._sessions = itertools.count(1)
+        self._server = ThreadingHTTPServer((host, port), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def address(self):
+        host, port = self._server.server_address[:2]
+        return f'{host}:{port}'
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name='fmg-simulator', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    # Add an ADOM object (template, group, package, script, variable...) so that gets of its url find it
+    def add_object(self, url, data=None):
+        url = _norm(url)
+        self.objects[url] = data if data is not None else {'name': url.rsplit('/', 1)[-1]}
+
+    def reset_counters(self):
+        with self._lock:
+            self.requests = 0
+            self.calls = 0
+            self.call_counts.clear()
+
+    def _handler_class(self):
+        sim = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            # Headers and body are written separately, without this every response waits on a delayed ACK
+            disable_nagle_algorithm = True
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                response = json.dumps(sim.handle(json.loads(body))).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(response)))
+                self.end_headers()
+                self.wfile.write(response)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    # Handle one JSON-RPC request, returns the response object
+    def handle(self, request):
+        with self._lock:
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+            load = self.in_flight / self.capacity if self.capacity > 0 else 1
+        try:
+            if self.latency:
+                time.sleep(self.latency * max(load, 1) ** 2)
+            return self._handle(request)
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+    def _handle(self, request):
+        method = request.get('method')
+        params = request.get('params') or [{}]
+        response = {'id': request.get('id'), 'result': []}
+        with self._lock:
+            self.requests += 1
+            for param in params:
+                self.calls += 1
+                url = _norm(param.get('url', ''))
+                self.call_counts[(method, _pattern(url))] += 1
+                try:
+                    code, message, data = self._call(method, url, param)
+                except (KeyError, IndexError, TypeError, AttributeError, ValueError) as e:
+                    # Malformed params get an error status, like FMG, rather than a dropped connection
+                    code, message, data = -10, f'The data is invalid for selected url: {e!r}', None
+                result = {'status': {'code': code, 'message': message}, 'url': param.get('url')}
+                if data is not None:
+                    result['data'] = data
+                response['result'].append(result)
+                if url == 'sys/login/user' and code == 0:
+                    response['session'] = f'sim-session-{next(self._sessions)}'
+        return response
+
+    def _call(self, method, url, param):
+        data = param.get('data')
+
+        if url == 'sys/login/user' or url == 'sys/logout':
+            return 0, 'OK', None
+        if url == 'cli/global/system/global':
+            return 0, 'OK', {'workspace-mode': 0, 'adom-status': 1}
+
+        if url.startswith('task/task'):
+            return self._task_call(method, url, param)
+
+        if url == 'dvmdb/device' or (url.startswith('dvmdb/adom/') and url.endswith('/device')):
+            if method == 'get':
+                adom = url.split('/')[2] if url.startswith('dvmdb/adom/') else None
+                return 0, 'OK', _query(self._dvm_records(adom, param.get('filter')), param)
+
+        if method == 'exec' and url == 'dvm/cmd/add/device':
+            return self._add_device(data)
+        if method == 'exec' and url == 'dvm/cmd/del/device':
+            return self._del_device(data)
+        if method == 'exec' and url == 'dvm/cmd/del/dev-list':
+            return self._del_dev_list(data)
+        if method == 'exec' and url.startswith('securityconsole/install/'):
+            return self._install(data)
+
+        if url.endswith(' member') or url.endswith('/dynamic_mapping'):
+            if method == 'get':
+                return 0, 'OK', list(self.members.get(url, []))
+            if method in ('add', 'set'):
+                return self._add_members(url, data)
+
+        if method == 'get':
+            if url in self.objects:
+                return 0, 'OK', self.objects[url]
+            children = [obj for obj_url, obj in self.objects.items() if obj_url.rsplit('/', 1)[0] == url]
+            if children:
+                return 0, 'OK', _query(children, param)
+            return -3, 'Object does not exist', None
+
+        return 0, 'OK', None
+
+    # DVM records to filter, looked up directly for the single name/sn filters ModelDevice uses for every device
+    def _dvm_records(self, adom, flt):
+        if flt and not isinstance(flt[0], list) and flt[1] == '==' and flt[0] in ('name', 'sn'):
+            name = flt[2] if flt[0] == 'name' else self._name_by_sn.get(flt[2])
+            records = [self.devices[name]] if name in self.devices else []
+        else:
+            records = self.devices.values()
+        return [d for d in records if adom is None or d['adom'] == adom]
+
+    def _add_device(self, data):
+        device = data['device']
+        if device['name'] in self.devices:
+            return -2, 'Object already exists', None
+        if device['sn'] in self._name_by_sn:
+            return -2, 'Serial number already exists', None
+        self._name_by_sn[device['sn']] = device['name']
+        self.devices[device['name']] = {
+            'name': device['name'],
+            'sn': device['sn'],
+            'oid': next(self._oids),
+            'adom': data.get('adom', 'root'),
+            'platform_str': device.get('platform_str'),
+            'os_ver': device.get('os_ver'),
+            'mr': device.get('mr'),
+            'patch': device.get('patch'),
+            'desc': device.get('desc'),
+            'conf_status': 0,
+            'db_status': 0,
+            'conn_status': 0,
+            'dev_status': 1,
+            'mgmt_mode': 3,
+        }
+        return self._new_task([device['name']])
+
+    def _del_device(self, data):
+        name = data['device']
+        device = self.devices.pop(name, None)
+        if device is None:
+            return -3, 'Object does not exist', None
+        del self._name_by_sn[device['sn']]
+        return self._new_task([name])
+
+    def _del_dev_list(self, data):
+        names = [member['name'] for member in data.get('del-dev-member-list', [])]
+        errors = {}
+        for name in names:
+            device = self.devices.pop(name, None)
+            if device is None:
+                errors[name] = 'Object does not exist'
+            else:
+                del self._name_by_sn[device['sn']]
+        return self._new_task(names, errors)
+
+    def _install(self, data):
+        scope = data.get('scope', [])
+        scope = [scope] if isinstance(scope, dict) else scope
+        errors = {entry['name']: 'Device not found' for entry in scope if entry['name'] not in self.devices}
+        for entry in scope:
+            if entry['name'] in self.devices:
+                self.devices[entry['name']]['db_status'] = 1
+        return self._new_task([entry['name'] for entry in scope], errors)
+
+    def _add_members(self, url, data):
+        if not data:
+            return -10, 'The data is invalid for selected url', None
+        entries = data if isinstance(data, list) else [data]
+        if self.strict_objects and not url.endswith('/dynamic_mapping'):
+            target = url.rsplit('/', 1)[0]
+            if target not in self.objects:
+                return -3, 'Object does not exist', None
+        members = self.members.setdefault(url, [])
+        for entry in entries:
+            scope = entry.get('_scope', entry)
+            scope = scope[0] if isinstance(scope, list) else scope
+            if scope.get('name') not in self.devices:
+                return -3, f'Object does not exist: {scope.get("name")}', None
+        for entry in entries:
+            if entry not in members:
+                members.append(entry)
+            # The device now has changes waiting for an install (db_status 'mod')
+            scope = entry.get('_scope', entry)
+            scope = scope[0] if isinstance(scope, list) else scope
+            self.devices[scope['name']]['db_status'] = 2
+        return 0, 'OK', None
+
+    def _new_task(self, names, errors=None):
+        errors = errors or {}
+        taskid = next(self._task_ids)
+        self.tasks[taskid] = {
+            'id': taskid,
+            'start_tm': int(time.time()),
+            'started': time.time(),
+            'num_lines': len(names),
+            'num_err': len(errors),
+            'num_warn': 0,
+            'line': [{'name': n, 'vdom': None, 'err': 1 if n in errors else 0, 'detail': errors.get(n, 'success')}
+                     for n in names],
+        }
+        return 0, 'OK', {'taskid': taskid}
+
+    def _task_record(self, task):
+        if self.task_duration > 0:
+            percent = min(int((time.time() - task['started']) / self.task_duration * 100), 100)
+        else:
+            percent = 100
+        record = {k: v for k, v in task.items() if k != 'started'}
+        record['percent'] = percent
+        record['num_done'] = task['num_lines'] if percent == 100 else 0
+        record['state'] = 4 if percent == 100 else 1
+        return record
+
+    def _task_call(self, method, url, param):
+        parts = url.split('/')
+        if len(parts) == 3:
+            taskid = int(parts[2])
+            if taskid not in self.tasks:
+                return -3, 'Object does not exist', None
+            if method == 'delete':
+                del self.tasks[taskid]
+                return 0, 'OK', None
+            return 0, 'OK', self._task_record(self.tasks[taskid])
+        return 0, 'OK', _query([self._task_record(t) for t in self.tasks.values()], param)
+
+
+def _norm(url):
+    return url.strip().strip('/')
+
+
+# Collapse object names out of a url so that call counts group by endpoint
+def _pattern(url):
+    parts = url.split('/')
+    if url.startswith('task/task/'):
+        return 'task/task/<id>'
+    if url.endswith('/dynamic_mapping'):
+        return '/'.join(parts[:3]) + '/<adom>/obj/fmg/variable/<var>/dynamic_mapping'
+    if url.endswith(' member'):
+        return '/'.join(parts[:-2]) + '/<name>/' + parts[-1]
+    return url
+
+
+# Apply FMG style 'filter', 'fields' and 'range' params to a list of records
+def _query(records, param):
+    if param.get('filter'):
+        records = [r for r in records if _match(r, param['filter'])]
+    if param.get('range'):
+        offset, limit = param['range']
+        records = records[offset:offset + limit]
+    if param.get('fields'):
+        fields = param['fields']
+        records = [{k: r.get(k) for k in fields if k in r} for r in records]
+    return records
+
+
+def _match(record, flt):
+    if not flt:
+        return True
+    if isinstance(flt[0], list):
+        result = _match(record, flt[0])
+        for i in range(1, len(flt) - 1, 2):
+            if flt[i] == '||':
+                result = result or _match(record, flt[i + 1])
+            else:
+                result = result and _match(record, flt[i + 1])
+        return result
+    field, op, *values = flt
+    value = record.get(field)
+    if op == '==':
+        return value == values[0]
+    if op == '!=':
+        return value != values[0]
+    if op == 'in':
+        return value in values
+    if op in ('<', '>', '<=', '>='):
+        if value is None:
+            return False
+        return {'<': value < values[0], '>': value > values[0], '<=': value <= values[0], '>=': value >= values[0]}[op]
+    if op == 'like':
+        return str(values[0]).replace('%', '') in str(value)
+    return False
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--task_duration', type=float, default=0.0)
+    parser.add_argument('--capacity', type=int, default=0)
+    args = parser.parse_args()
+
+    simulator = FmgSimulator(args.host, args.port, args.latency, args.task_duration, capacity=args.capacity)
+    print(f'FMG simulator listening on http://{simulator.address}/jsonrpc')
+    try:
+        simulator._server.serve_forever()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,207 @@
+import csv
+import yaml
+from modeldevice import DeviceProfile
+
+# Use the libyaml C loader when PyYAML was built with it, it parses several times faster than the pure python one
+try:
+    from yaml import CSafeLoader as InventoryLoader
+except ImportError:
+    from yaml import SafeLoader as InventoryLoader
+
+
+# Yield (device name, device dict) for each entry of the top level mapping of a device yaml stream, one entry at a
+# time as it is parsed, so processing can start on the first device while the rest of the file is still being read
+# and only one device's data is built at a time.  Gives the same values as yaml.safe_load() for each entry.
+def iter_inventory(stream):
+    loader = InventoryLoader(stream)
+    try:
+        loader.get_event()  # StreamStartEvent
+        if loader.check_event(yaml.StreamEndEvent):
+            return
+        loader.get_event()  # DocumentStartEvent
+        if loader.check_event(yaml.ScalarEvent):
+            # Empty document (or a lone scalar), nothing to process
+            return
+        if not loader.check_event(yaml.MappingStartEvent):
+            raise yaml.YAMLError('Device yaml file must be a mapping of device name to device settings')
+        loader.get_event()
+
+        anchors = {}
+        while not loader.check_event(yaml.MappingEndEvent):
+            name_node = _compose_node(loader, anchors)
+            device_node = _compose_node(loader, anchors)
+            name = loader.construct_object(name_node, deep=True)
+            device = loader.construct_object(device_node, deep=True)
+            # Forget constructed objects so memory use does not grow with the number of devices
+            loader.constructed_objects = {}
+            loader.recursive_objects = {}
+            yield name, device
+    finally:
+        loader.dispose()
+
+
+# Open and stream a device yaml file (see iter_inventory), or a CSV one (see iter_csv_inventory) if the name ends
+# with .csv
+def iter_inventory_file(path):
+    with open(path, newline='' if path.lower().endswith('.csv') else None) as f:
+        if path.lower().endswith('.csv'):
+            yield from iter_csv_inventory(f)
+        else:
+            yield from iter_inventory(f)
+
+
+# Prefix of the CSV columns holding metadata variables, e.g. 'meta_vars.site_id'
+CSV_META_VARS = 'meta_vars.'
+
+
+# Yield (device name, device dict) for each row of a CSV inventory.  Columns are device yaml keys ('name' is the
+# device name, usually with 'serial_num' and 'profile'), 'meta_vars.<variable>' columns are collected into the
+# device's meta_vars.  Empty cells are left out so the value comes from the device's profile.
+def iter_csv_inventory(stream):
+    for row in csv.DictReader(stream):
+        device = {}
+        meta_vars = {}
+        for key, value in row.items():
+            if key is None or value is None or value == '':
+                continue
+            key = key.strip()
+            if key.startswith(CSV_META_VARS):
+                meta_vars[key[len(CSV_META_VARS):]] = value
+            else:
+                device[key] = value
+        if meta_vars:
+            device['meta_vars'] = meta_vars
+        name = device.pop('name', None)
+        if name is not None:
+            yield name, device
+
+
+# Inventory entries holding settings shared by many devices rather than a device: '_defaults' applies to every
+# device, '_profiles' is a mapping of profile name to settings, picked by a device with 'profile: <name>'.  A device
+# gets its own settings, else its profile's, else the defaults.  In a streamed file they must come before the
+# devices using them.
+DEFAULTS_KEY = '_defaults'
+PROFILES_KEY = '_profiles'
+
+
+# The '_defaults' and '_profiles' of an inventory, as shared DeviceProfile objects (see modeldevice.py)
+class InventoryProfiles:
+    def __init__(self):
+        self.defaults = None
+        self.profiles = {}
+        self.raw = {}  # the entries as read, for writing them out again (shard.py)
+
+    # Take in a top level inventory entry, returns False if it is a device rather than defaults/profiles
+    def add_entry(self, key, value):
+        if key not in (DEFAULTS_KEY, PROFILES_KEY):
+            return False
+        # Entries are merged, so fgt_yaml can add to or override the profiles of a --profiles file
+        self.raw[key] = {**self.raw.get(key, {}), **(value or {})}
+        if DEFAULTS_KEY in self.raw:
+            self.defaults = DeviceProfile(DEFAULTS_KEY, self.raw[DEFAULTS_KEY])
+        self.profiles = {name: DeviceProfile(name, settings, self.defaults)
+                         for name, settings in self.raw.get(PROFILES_KEY, {}).items()}
+        return True
+
+    # Replace the 'profile' name of the device dict with the DeviceProfile (the defaults for devices without one)
+    def resolve(self, fg, device):
+        name = device.get('profile')
+        if isinstance(name, DeviceProfile):
+            return device
+        if name is None:
+            if self.defaults is not None:
+                device['profile'] = self.defaults
+        elif name in self.profiles:
+            device['profile'] = self.profiles[name]
+        else:
+            raise yaml.YAMLError(f'Device {fg} uses profile "{name}", which is not defined in {PROFILES_KEY} '
+                                 f'(before the device)')
+        return device
+
+    # Load the entries of a profiles yaml file (one holding just '_defaults' and/or '_profiles')
+    def load(self, path):
+        for key, value in iter_inventory_file(path):
+            if not self.add_entry(key, value):
+                raise yaml.YAMLError(f'{path}: only {DEFAULTS_KEY} and {PROFILES_KEY} are expected, found {key}')
+        return self
+
+
+# Yield (device name, device dict) for the devices of (name, dict) inventory entries, taking in any defaults and
+# profiles entries along the way (into 'profiles', a new InventoryProfiles if not passed in) and resolving each
+# device's profile.
+def iter_devices(entries, profiles=None):
+    profiles = InventoryProfiles() if profiles is None else profiles
+    for fg, device in entries:
+        if profiles.add_entry(fg, device):
+            continue
+        yield fg, profiles.resolve(fg, device if device is not None else {})
+
+
+# A device setting by yaml key, from the device dict or else its profile (for keys DeviceRecord does not hold)
+def device_setting(device, key, default=None):
+    if key in device:
+        return device[key]
+    profile = device.get('profile')
+    if isinstance(profile, DeviceProfile):
+        return profile.settings.get(key, default)
+    return default
+
+
+# Device dict as written in an inventory file, with the profile by name
+def unresolved(device):
+    profile = device.get('profile')
+    if not isinstance(profile, DeviceProfile):
+        return device
+    device = dict(device)
+    if profile.name == DEFAULTS_KEY:
+        del device['profile']
+    else:
+        device['profile'] = profile.name
+    return device
+
+
+# Build the node for the next value in the event stream.  Same as yaml's Composer, which the C loader does not
+# expose per node, only per document.
+def _compose_node(loader, anchors):
+    if loader.check_event(yaml.AliasEvent):
+        event = loader.get_event()
+        if event.anchor not in anchors:
+            raise yaml.composer.ComposerError(None, None, f'found undefined alias {event.anchor}', event.start_mark)
+        return anchors[event.anchor]
+
+    event = loader.get_event()
+    if isinstance(event, yaml.ScalarEvent):
+        tag = event.tag
+        if tag is None or tag == '!':
+            tag = loader.resolve(yaml.ScalarNode, event.value, event.implicit)
+        node = yaml.ScalarNode(tag, event.value, event.start_mark, event.end_mark, style=event.style)
+    elif isinstance(event, yaml.SequenceStartEvent):
+        tag = event.tag
+        if tag is None or tag == '!':
+            tag = loader.resolve(yaml.SequenceNode, None, event.implicit)
+        node = yaml.SequenceNode(tag, [], event.start_mark, None, flow_style=event.flow_style)
+        if event.anchor is not None:
+            anchors[event.anchor] = node
+        while not loader.check_event(yaml.SequenceEndEvent):
+            node.value.append(_compose_node(loader, anchors))
+        node.end_mark = loader.get_event().end_mark
+        return node
+    elif isinstance(event, yaml.MappingStartEvent):
+        tag = event.tag
+        if tag is None or tag == '!':
+            tag = loader.resolve(yaml.MappingNode, None, event.implicit)
+        node = yaml.MappingNode(tag, [], event.start_mark, None, flow_style=event.flow_style)
+        if event.anchor is not None:
+            anchors[event.anchor] = node
+        while not loader.check_event(yaml.MappingEndEvent):
+            key_node = _compose_node(loader, anchors)
+            value_node = _compose_node(loader, anchors)
+            node.value.append((key_node, value_node))
+        node.end_mark = loader.get_event().end_mark
+        return node
+    else:
+        raise yaml.composer.ComposerError(None, None, f'unexpected {event.__class__.__name__}', event.start_mark)
+
+    if event.anchor is not None:
+        anchors[event.anchor] = node
+    return node
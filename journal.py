@@ -0,0 +1,63 @@
+import sqlite3
+import threading
+import time
+
+
+# On-disk record of the pipeline steps each device has completed, so that a run that died part way through can be
+# resumed without repeating the work already done.  A completed step is keyed on device name and serial number, so a
+# device that is re-used with a different serial number in the inventory starts over.  Completed steps are read into
+# memory when the journal is opened, lookups never touch the database; every completion is committed right away.
+# A read_only journal (plan mode) keeps completions in memory only.  Starting a new run (no resume) on a journal that
+# holds an earlier run's steps raises FileExistsError unless reset is set, a forgotten --resume must not wipe them.
+class StepJournal:
+    def __init__(self, path, resume: bool = True, read_only: bool = False, reset: bool = False):
+        self.path = path
+        self.read_only = read_only
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        # WAL and synchronous=NORMAL keep a commit per step cheap while still surviving the process being killed
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute('CREATE TABLE IF NOT EXISTS steps (device TEXT NOT NULL, serial_num TEXT, step TEXT NOT '
+                           'NULL, completed REAL NOT NULL, PRIMARY KEY (device, step))')
+        self._done = {}  # (device, step) -> serial number
+        if resume:
+            for device, serial_num, step in self._conn.execute('SELECT device, serial_num, step FROM steps'):
+                self._done[(device, step)] = serial_num
+        elif not read_only:
+            if not reset and self._conn.execute('SELECT 1 FROM steps LIMIT 1').fetchone() is not None:
+                self._conn.close()
+                raise FileExistsError(f'Journal {path} holds the completed steps of an earlier run')
+            # New run, forget anything journaled by earlier runs
+            self._conn.execute('DELETE FROM steps')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def completed(self, device, step, serial_num=None):
+        key = (device, step)
+        return key in self._done and self._done[key] == serial_num
+
+    # Record that 'step' completed for each (device, serial number) pair in one transaction
+    def record(self, step, devices):
+        now = time.time()
+        rows = [(device, serial_num, step, now) for device, serial_num in devices]
+        with self._lock:
+            if not self.read_only:
+                self._conn.execute('BEGIN')
+                self._conn.executemany('INSERT OR REPLACE INTO steps (device, serial_num, step, completed) '
+                                       'VALUES (?, ?, ?, ?)', rows)
+                self._conn.execute('COMMIT')
+            for device, serial_num, step, completed in rows:
+                self._done[(device, step)] = serial_num
+
+    # Number of devices with at least one completed step
+    def devices(self):
+        return len({device for device, step in self._done})
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -1,43 +1,154 @@
-class ModelDevice:
-    # Class initializer
-    def __init__(self, device: dict = None, fmg_api=None, fmg_ver: int = 70):
+# Device settings read from the device yaml: (attribute, yaml key, default when the key is not set)
+DEVICE_FIELDS = (
+    ('adom', 'adom', 'root'),
+    ('vdom', 'vdom', 'root'),
+    ('user', 'login', 'admin'),
+    ('password', 'password', ''),
+    ('descr', 'descr', ''),
+    ('device_blueprint', 'device_blueprint', None),
+    ('name', 'name', None),
+    ('serial_num', 'serial_num', None),
+    ('meta_vars', 'meta_vars', ''),
+    ('platform', 'platform', None),
+    ('policy_package', 'policy_package', None),
+    ('preferred_img', 'preferred_img', None),
+    ('group', 'group', None),
+    ('sdwan_template', 'sdwan_template', None),
+    ('pre_cli_template', 'pre_cli_template', None),
+    ('cli_template_group', 'cli_template_group', None),
+    ('template_group', 'template_group', None),
+    ('psk', 'psk', None),
+    ('fmg_script', 'fmg_script', None),
+    ('os_major', 'major_version', 7),
+    ('os_minor', 'minor_version', 4),
+    ('os_patch', 'patch_version', 4),
+    ('vdomenabled', 'vdomenabled', False),
+)
+
+# Attributes each ModelDevice method requires to be set (same as the MdDataError checks in each method)
+REQUIRED_FIELDS = {
+    'add': ('adom', 'vdom', 'name', 'serial_num', 'platform'),
+    'delete': ('adom', 'name'),
+    'add_to_pre_cli_script': ('adom', 'name', 'pre_cli_template'),
+    'install_device_db': ('adom', 'vdom', 'name'),
+    'add_to_dev_group': ('adom', 'vdom', 'name', 'group'),
+    'add_to_sdwan_templ': ('adom', 'vdom', 'name', 'sdwan_template'),
+    'add_to_cli_templ_group': ('adom', 'vdom', 'name', 'cli_template_group'),
+    'add_to_templ_group': ('adom', 'vdom', 'name', 'template_group'),
+    'add_fmg_meta_vars_mapping': ('adom', 'name'),
+    'add_to_pol_pkg': ('adom', 'vdom', 'name', 'policy_package'),
+    'install_pol_pkg_to_db': ('adom', 'vdom', 'name', 'policy_package'),
+    'check_fmg_script': ('adom', 'vdom', 'name', 'fmg_script'),
+}
+
+
+_FIELD_DEFAULTS = {attr: default for attr, key, default in DEVICE_FIELDS}
+
+
+# Settings shared by many devices of an inventory (its '_defaults' and '_profiles' entries, see inventory.py),
+# converted to DeviceRecord attributes once.  Every DeviceRecord using the profile refers to this one object and
+# only stores the settings it overrides.  A profile builds on the settings of 'parent' (the inventory defaults).
+class DeviceProfile:
+    __slots__ = ('name', 'settings', 'values')
+
+    def __init__(self, name, settings=None, parent=None):
+        self.name = name
+        # yaml keys, including ones DeviceRecord does not use (e.g. 'fmg' for shard.py)
+        self.settings = dict(parent.settings) if parent is not None else {}
+        self.settings.update(settings or {})
+        self.values = {}
+        for attr, key, default in DEVICE_FIELDS:
+            if key in self.settings:
+                self.values[attr] = self.settings[key]
+        if 'vdomenabled' in self.values:
+            self.values['vdomenabled'] = self.values['vdomenabled'] in (True, 'true', 'True')
+
+    def __repr__(self):
+        return f'DeviceProfile({self.name!r})'
+
+
+# Compact record of one device's settings.  Built from the device yaml dictionary using DEVICE_FIELDS, uses
+# __slots__ so no per-instance __dict__ is kept, and can validate up front that every field required by the
+# methods that are going to be run is set, rather than that showing up later as MdDataError part way through.
+# When the device dictionary's 'profile' is a DeviceProfile, only the settings the device sets itself are stored
+# and the others are read from the shared profile.
+class DeviceRecord:
+    __slots__ = tuple(attr for attr, key, default in DEVICE_FIELDS) + ('profile',)
+
+    def __init__(self, device=None, validate_for=()):
+        self.profile = None
+        if device is None:
+            device = {}
+        if isinstance(device, DeviceRecord):
+            self.profile = device.profile
+            for attr in _FIELD_DEFAULTS:
+                try:
+                    setattr(self, attr, object.__getattribute__(device, attr))
+                except AttributeError:
+                    pass  # from the profile
+        elif isinstance(device, dict):
+            profile = device.get('profile')
+            if isinstance(profile, DeviceProfile):
+                self.profile = profile
+                for attr, key, default in DEVICE_FIELDS:
+                    if key in device:
+                        setattr(self, attr, device[key])
+                if 'vdomenabled' in device:
+                    self.vdomenabled = self.vdomenabled in (True, 'true', 'True')
+            elif profile is not None:
+                raise TypeError(f"CLASS ModelDevice: profile '{profile}' was not resolved, see inventory.py")
+            else:
+                for attr, key, default in DEVICE_FIELDS:
+                    setattr(self, attr, device.get(key, default))
+                self.vdomenabled = self.vdomenabled in (True, 'true', 'True')
+        else:
+            raise TypeError("CLASS ModelDevice: 'device' param when passed, must be type 'dict'")
+
+        self.validate(validate_for)
+
+    # Only called for settings not stored on the record itself: the profile's value, else the default
+    def __getattr__(self, attr):
+        if attr in _FIELD_DEFAULTS:
+            profile = self.profile
+            if profile is not None and attr in profile.values:
+                return profile.values[attr]
+            return _FIELD_DEFAULTS[attr]
+        raise AttributeError(attr)
+
+    # Raise MdDataError for the first required field that is not set for any of the passed in method names
+    def validate(self, methods):
+        for method in methods:
+            for attr in REQUIRED_FIELDS[method]:
+                if getattr(self, attr) is None:
+                    raise MdDataError(attr, method)
+
+    # All set attributes as a dictionary
+    def as_dict(self):
+        values = {}
+        for cls in type(self).__mro__:
+            for attr in getattr(cls, '__slots__', ()):
+                if hasattr(self, attr):
+                    values[attr] = getattr(self, attr)
+        return values
+
+
+class ModelDevice(DeviceRecord):
+    __slots__ = ('debug', 'verbose', 'fmg_ver', '_api', 'dvm_index', 'task_tracker', 'events')
+
+    # Class initializer.  'device' is the device yaml dictionary or a DeviceRecord, validate_for is a list of method
+    # names (see REQUIRED_FIELDS) to check the required settings of when the object is created.
+    def __init__(self, device=None, fmg_api=None, fmg_ver: int = 70, validate_for=()):
+        super().__init__(device, validate_for)
 
         self.debug = False
         self.verbose = False
-
-        # If device dictionary was passed in on instantiation try to set the relevant values
-        if device is not None and not isinstance(device, dict):
-            raise TypeError("CLASS ModelDevice: 'device' param when passed, must be type 'dict'")
-        # Add values from device dictionary to self if they exist in dictionary, otherwise set to None
-        self.adom = device['adom'] if 'adom' in device else 'root'
-        self.vdom = device['vdom'] if 'vdom' in device else 'root'
-        self.user = device['login'] if 'login' in device else 'admin'
-        self.password = device['password'] if 'password' in device else ''
-        self.descr = device['descr'] if 'descr' in device else ''
-        self.device_blueprint = device['device_blueprint'] if 'device_blueprint' in device else None
         self.fmg_ver = fmg_ver
-        self.name = device['name'] if 'name' in device else None
-        self.serial_num = device['serial_num'] if 'serial_num' in device else None
-        self.meta_vars = device['meta_vars'] if 'meta_vars' in device else ''
-        self.platform = device['platform'] if 'platform' in device else None
-        self.policy_package = device['policy_package'] if 'policy_package' in device else None
-        self.preferred_img = device['preferred_img'] if 'preferred_img' in device else None
-        self.group = device['group'] if 'group' in device else None
-        self.sdwan_template = device['sdwan_template'] if 'sdwan_template' in device else None
-        self.pre_cli_template = device['pre_cli_template'] if 'pre_cli_template' in device else None
-        self.cli_template_group = device['cli_template_group'] if 'cli_template_group' in device else None
-        self.template_group = device['template_group'] if 'template_group' in device else None
-        self.psk = device['psk'] if 'psk' in device else None
-        self.fmg_script = device['fmg_script'] if 'fmg_script' in device else None
-        self.os_major = device['major_version'] if 'major_version' in device else 7
-        self.os_minor = device['minor_version'] if 'minor_version' in device else 4
-        self.os_patch = device['patch_version'] if 'patch_version' in device else 4
-
-        if 'vdomenabled' in device:
-            if device['vdomenabled'] == 'true' or device['vdomenabled'] == 'True':
-                self.vdomenabled = True
-        else:
-            self.vdomenabled = False
+        # Optional DvmIndex (see dvmindex.py) used to answer name/sn existence checks without querying FMG
+        self.dvm_index = None
+        # Optional TaskTracker (see tasktracker.py) used instead of pyFMG's blocking api.track_task()
+        self.task_tracker = None
+        # Optional EventLog (see eventlog.py), per item results are sent to it instead of being printed
+        self.events = None
 
         # If fmg_api param was passed in, then try to set it (see also api property and setter)
         if fmg_api is not None: self.api = fmg_api
@@ -54,7 +165,7 @@ class ModelDevice:
     # Object stringification
     def __str__(self):
         # Return all instance variables as string
-        return str(vars(self))
+        return str(self.as_dict())
 
     # Function to determine result of pyfgt api requests
     def __api_result(self, code, msg):
@@ -73,7 +184,12 @@ class ModelDevice:
 
     # Function to analyze task based FMG API call results
     def __api_task_result(self, a_taskid):
-        code, msg = self.api.track_task(a_taskid)  # pyfgt class function (track_task)
+        if self.task_tracker is not None:
+            code, msg = self.task_tracker.track_task(a_taskid)
+        else:
+            code, msg = self.api.track_task(a_taskid)  # pyfgt class function (track_task)
+        if code != 0:
+            return 1, msg
         if msg['num_err'] > 0:
             return 1, msg['line'][-1]
         elif msg['num_warn'] > 0:
@@ -134,7 +250,10 @@ class ModelDevice:
                 data['device']['device blueprint'] = self.device_blueprint
 
         rcode, rmsg = self.api.execute(url, data=data)
-        return self.__api_result(rcode, rmsg)
+        result = self.__api_result(rcode, rmsg)
+        if result[0] == 0 and self.dvm_index is not None:
+            self.dvm_index.add_device(self.name, self.serial_num)
+        return result
 
     # Delete existing model device object from FMG via passed in ftntlib 'api'
     def delete(self):
@@ -143,13 +262,14 @@ class ModelDevice:
         # if self.vdom is None: raise MdDataError('vdom', 'delete')
         if self.name is None: raise MdDataError('name', 'delete')
 
-        if self.check_dev_name_in_fmg():
+        # Always check against FMG itself, the index may come from a snapshot older than a re-registration of the name
+        if self.check_dev_name_in_fmg(live=True):
             # If serial number is set, check to see if name and serial number associated in dvmdb
             # If serial number is not set do not do this check and continue
             if self.serial_num is not None:
                 # If both device name and serial exist in dvm check to see if they are for the same device,
                 # if not, raise an exception
-                if self.check_exist_dev_name_and_sn_same():
+                if self.check_exist_dev_name_and_sn_same(live=True):
                     url = 'dvm/cmd/del/device/'
                     data = {
                         'adom': self.adom,
@@ -159,7 +279,10 @@ class ModelDevice:
                     }
 
                     rcode, rmsg = self.api.execute(url, data=data)
-                    return self.__api_result(rcode, rmsg)
+                    result = self.__api_result(rcode, rmsg)
+                    if result[0] == 0 and self.dvm_index is not None:
+                        self.dvm_index.remove_device(self.name)
+                    return result
 
                 else:
                     raise MdFmgDvmError('Supplied device name and sn are not associated in fmg dvmdb')
@@ -173,14 +296,35 @@ class ModelDevice:
         if self.name is None: raise MdDataError('name', 'add_to_pre_cli_script')
         if self.pre_cli_template is None: raise MdDataError('pre_cli_template', 'add_to_pre_cli_script')
 
-        url = f'/pm/config/adom/{self.adom}/obj/cli/template/{self.pre_cli_template}/scope member'
-        data = {
-            "name": self.name,
-            "vdom": 'global'  # Must set this to global, not sure why...
-        }
+        url, data = self.scope_member('add_to_pre_cli_script')
         response = self.api.add(url, data=data)
         return self.__api_result(response[1]['status']['code'],response[1]['status']['message'])
 
+    # URL and member entry used to add this device to the scope of the object targeted by the passed in add_to_*
+    # method.  Shared by the add_to_* methods and ModelDeviceFleet.add_scope_members (see fleet.py).
+    def scope_member(self, method):
+        member = {
+            "name": self.name,
+            "vdom": self.vdom
+        }
+        if method == 'add_to_pre_cli_script':
+            url = f'/pm/config/adom/{self.adom}/obj/cli/template/{self.pre_cli_template}/scope member'
+            member['vdom'] = 'global'  # Must set this to global, not sure why...
+        elif method == 'add_to_dev_group':
+            url = f'/dvmdb/adom/{self.adom}/group/{self.group}/object member'
+        elif method == 'add_to_sdwan_templ':
+            url = f'/pm/wanprof/adom/{self.adom}/{self.sdwan_template}/scope member'
+        elif method == 'add_to_cli_templ_group':
+            url = f'/pm/config/adom/{self.adom}/obj/cli/template-group/{self.cli_template_group}/scope member'
+        elif method == 'add_to_templ_group':
+            # url = f'/pm/config/adom/{self.adom}/tmplgrp/{self.template_group}/scope member'
+            url = f'/pm/tmplgrp/adom/{self.adom}/{self.template_group}/scope member'
+        elif method == 'add_to_pol_pkg':
+            url = f'/pm/pkg/adom/root/{self.policy_package}/scope member'
+        else:
+            raise ValueError(f'No scope member target for method {method}')
+        return url, member
+
     # Function to quick install settings for device to device DB (for pre-run cli template assign)
     def install_device_db(self):
         # Check for required parameters
@@ -207,11 +351,7 @@ class ModelDevice:
         if self.name is None: raise MdDataError('name', 'add_to_dev_group')
         if self.group is None: raise MdDataError('group', 'add_to_dev_group')
 
-        url = f'/dvmdb/adom/{self.adom}/group/{self.group}/object member'
-        data = {
-            "name": self.name,
-            "vdom": self.vdom
-        }
+        url, data = self.scope_member('add_to_dev_group')
         rcode, rmsg = self.api.add(url, data=data)
         return self.__api_result(rcode, rmsg)
 
@@ -237,11 +377,7 @@ class ModelDevice:
         if self.name is None: raise MdDataError('name', 'add_to_sdwan_template')
         if self.sdwan_template is None: raise MdDataError('sdwan_template', 'add_to_sdwan_template')
 
-        url = f'/pm/wanprof/adom/{self.adom}/{self.sdwan_template}/scope member'
-        data = {
-            "name": self.name,
-            "vdom": self.vdom
-        }
+        url, data = self.scope_member('add_to_sdwan_templ')
         rcode, rmsg = self.api.add(url, data=data)
         return self.__api_result(rcode, rmsg)
 
@@ -253,12 +389,7 @@ class ModelDevice:
         if self.name is None: raise MdDataError('name', 'add_to_cli_templ_group')
         if self.cli_template_group is None: raise MdDataError('sdwan_template', 'add_to_cli_templ_group')
 
-        url = f'/pm/config/adom/{self.adom}/obj/cli/template-group/{self.cli_template_group}/scope member'
-        data = {
-            "name": self.name,
-            "vdom": self.vdom
-            # "vdom": "global"
-        }
+        url, data = self.scope_member('add_to_cli_templ_group')
         rcode, rmsg = self.api.add(url, data=data)
         return self.__api_result(rcode, rmsg)
 
@@ -270,14 +401,7 @@ class ModelDevice:
         if self.name is None: raise MdDataError('name', 'add_to_cli_templ_group')
         if self.template_group is None: raise MdDataError('sdwan_template', 'add_to_cli_templ_group')
 
-        # url = f'/pm/config/adom/{self.adom}/tmplgrp/{self.template_group}/scope member'
-        url = f'/pm/tmplgrp/adom/{self.adom}/{self.template_group}/scope member'
-        data = {
-            "name": self.name,
-            "vdom": self.vdom
-            # "vdom": "global"
-        }
-
+        url, data = self.scope_member('add_to_templ_group')
         rcode, rmsg = self.api.add(url, data=data)
         return self.__api_result(rcode, rmsg)
 
@@ -288,7 +412,8 @@ class ModelDevice:
 
         meta_failed_list = []
         for i in self.meta_vars:
-            print(f'  << Adding: {i} >>')
+            if self.events is None:
+                print(f'  << Adding: {i} >>')
 
             url = f'/pm/config/adom/{self.adom}/obj/fmg/variable/{i}/dynamic_mapping'
             data = {
@@ -301,13 +426,20 @@ class ModelDevice:
             }
 
             rcode, rmsg = self.api.add(url, data=data)
-            if rcode == 0:
+            if rcode != 0:
+                meta_failed_list.append(i)
+            if self.events is not None:
+                self.events.emit('meta_var', device=self.name, var=i, code=rcode, msg=rmsg if rcode != 0 else None)
+            elif rcode == 0:
                 print(f'     Success adding {i}')
             else:
                 print(f'    Failed to add {i}')
-                meta_failed_list.append(i)
 
-        
+        if self.events is not None:
+            if meta_failed_list:
+                return self.__api_result(1, f'failed: {meta_failed_list}')
+            return (0, 'Success')
+
         print('----------------------------------------------------------------------------------------------------')
         print('<--Overall Result of Meta Var Adds-->')
 
@@ -342,12 +474,8 @@ class ModelDevice:
         if self.name is None: raise MdDataError('name', 'add_to_pol_pkg')
         if self.policy_package is None: raise MdDataError('policy_package', 'add_to_pol_pkg')
 
-        url = f'/pm/pkg/adom/root/{self.policy_package}/scope member'
-        data = {
-            "name": self.name,
-            "vdom": self.vdom
-        }
-        rcode, rmsg = self.api.add(url, data)
+        url, data = self.scope_member('add_to_pol_pkg')
+        rcode, rmsg = self.api.add(url, data=data)
         return self.__api_result(rcode, rmsg)
 
     # Function to install previously assigned policy package to policy DB
@@ -367,14 +495,18 @@ class ModelDevice:
                 "vdom": self.vdom
             }
         }
-        rcode, rmsg = self.api.execute(url, data)
+        rcode, rmsg = self.api.execute(url, data=data)
         return self.__api_result(rcode, rmsg)
 
-    # Check if this object's name is already used as a device name in FMG DVM
-    def check_dev_name_in_fmg(self):
+    # Check if this object's name is already used as a device name in FMG DVM (with live=True always asking FMG)
+    def check_dev_name_in_fmg(self, live: bool = False):
         # Can't run if name parameter is not set (if not set return none)
         if self.name is None: return None
 
+        # Answer from the bulk pre-flight index when one has been loaded
+        if not live and self.dvm_index is not None and self.dvm_index.loaded:
+            return self.dvm_index.name_exists(self.name)
+
         url = "dvmdb/device/"
         data = {
             'filter': [
@@ -397,6 +529,9 @@ class ModelDevice:
         # Can't run if serial_num parameter is not set (if not set return none)
         if self.serial_num is None: return None
 
+        if self.dvm_index is not None and self.dvm_index.loaded:
+            return self.dvm_index.sn_exists(self.serial_num)
+
         url = "dvmdb/device/"
         data = {
             'filter': [
@@ -414,12 +549,16 @@ class ModelDevice:
         else:
             return 0
 
-    # If this object's name exists in FMG DVM, check if the serial number matches this object's serail number
-    def check_exist_dev_name_and_sn_same(self):
+    # If this object's name exists in FMG DVM, check if the serial number matches this object's serail number (with
+    # live=True always asking FMG)
+    def check_exist_dev_name_and_sn_same(self, live: bool = False):
         # Can't run without name and serial_number params, return None if one is missing
         if self.name is None: return None
         if self.serial_num is None: return None
 
+        if not live and self.dvm_index is not None and self.dvm_index.loaded:
+            return self.dvm_index.name_and_sn_same(self.name, self.serial_num)
+
         url = "dvmdb/device/"
         data = {
             'filter': [
@@ -499,6 +638,17 @@ class ModelDevice:
         return self.__api_result(rcode, rmsg)
 
 
+# ModelDevice attribute naming the FMG object each scope member add_to_* method assigns the device to
+SCOPE_MEMBER_TARGETS = {
+    'add_to_pre_cli_script': 'pre_cli_template',
+    'add_to_dev_group': 'group',
+    'add_to_sdwan_templ': 'sdwan_template',
+    'add_to_cli_templ_group': 'cli_template_group',
+    'add_to_templ_group': 'template_group',
+    'add_to_pol_pkg': 'policy_package',
+}
+
+
 # Custom Exception Class for this ModelDevice Class errors related to data/parameters
 class MdDataError(Exception):
     def __init__(self, message1, message2):
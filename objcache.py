@@ -0,0 +1,166 @@
+import copy
+import json
+import re
+import threading
+import time
+from concurrent.futures import Future
+
+# ADOM level objects that are the same for every device in a run: templates, template groups, device groups, SDWAN
+# templates, policy packages, scripts and metadata variables.  GETs of anything else (DVM devices, tasks, system
+# settings) always go to FMG.
+CACHEABLE_URLS = re.compile(r'^/?(pm/config/(adom/[^/]+|global)/obj/|pm/(tmplgrp|wanprof|pkg|devprof)/adom/|'
+                            r'dvmdb/adom/[^/]+/group/|dvmdb/(adom/[^/]+/)?script/)')
+
+# Codes of GET results that are cached, -3 (object does not exist) so that missing objects are only looked up once too
+CACHED_CODES = (0, -3)
+
+# Object attributes written through their own url (<object url>/scope member, ...).  Their lists are only cached for
+# the run, never kept in a store: memberships change with every device added anywhere, by anyone.
+MEMBER_ATTRS = ('scope member', 'object member', 'dynamic_mapping')
+
+
+# Run scoped cache of ADOM object GETs, wrapping a FortiManager api object (or any of the other api wrappers).
+# Results are keyed by url and request params and kept for ttl seconds.  Any add/set/update/delete/execute sent
+# through the cache drops the cached entries for the url written to, its children and the reads above it that return
+# what was written: a member add leaves a collection read limited to other fields (such as the name lists of the
+# reference check) in place.  Concurrent GETs of the same object share one request.  Anything else is passed straight
+# through.  With a store (see FmgSnapshot) the cache starts out with the objects an earlier run read, each kept until
+# it is store.max_age seconds old, and every object read or dropped (other than MEMBER_ATTRS lists) is read into or
+# dropped from the store as well.
+class ObjectCache:
+    def __init__(self, fmg_api, ttl: float = 300, store=None):
+        self.api = fmg_api
+        self.ttl = ttl
+        self.store = store
+        self.hits = 0
+        self.misses = 0
+        self.stored = 0
+        self._entries = {}  # (path, params) -> (expiry time, Future of (code, msg))
+        self._lock = threading.Lock()
+        if store is not None:
+            for path, params, result, fetched in store.objects():
+                if _member_attr(path) is not None:
+                    continue
+                future = Future()
+                future.set_result(result)
+                self._entries[(path, params)] = (fetched + store.max_age, future)
+            self.stored = len(self._entries)
+
+    def __getattr__(self, name):
+        return getattr(self.api, name)
+
+    def get(self, url, *args, **kwargs):
+        path = _path(url)
+        if not CACHEABLE_URLS.match(path):
+            return self.api.get(url, *args, **kwargs)
+
+        key = (path, json.dumps([args, kwargs], sort_keys=True, default=str))
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > time.time():
+                self.hits += 1
+                future = entry[1]
+                fetch = False
+            else:
+                self.misses += 1
+                future = Future()
+                self._entries[key] = (time.time() + self.ttl, future)
+                fetch = True
+
+        if fetch:
+            try:
+                result = self.api.get(url, *args, **kwargs)
+            except Exception as e:
+                self._forget(key, future)
+                future.set_exception(e)
+                raise
+            if result[0] not in CACHED_CODES:
+                self._forget(key, future)
+            elif self.store is not None and _member_attr(path) is None:
+                with self._lock:
+                    # Not stored if the object was written to while it was being read
+                    if self._entries.get(key, (None, None))[1] is future:
+                        self.store.put_object(key[0], key[1], result)
+            future.set_result(result)
+
+        code, msg = future.result()
+        return code, copy.deepcopy(msg)
+
+    def add(self, url, *args, **kwargs):
+        self.invalidate(url)
+        return self.api.add(url, *args, **kwargs)
+
+    def set(self, url, *args, **kwargs):
+        self.invalidate(url)
+        return self.api.set(url, *args, **kwargs)
+
+    def update(self, url, *args, **kwargs):
+        self.invalidate(url)
+        return self.api.update(url, *args, **kwargs)
+
+    def delete(self, url, *args, **kwargs):
+        self.invalidate(url)
+        return self.api.delete(url, *args, **kwargs)
+
+    def execute(self, url, *args, **kwargs):
+        self.invalidate(url)
+        return self.api.execute(url, *args, **kwargs)
+
+    def free_form(self, method, **kwargs):
+        if method != 'get':
+            for params in kwargs.get('data') or []:
+                if isinstance(params, dict) and 'url' in params:
+                    self.invalidate(params['url'])
+        return self.api.free_form(method, **kwargs)
+
+    # Drop cached entries for url, anything below it and the reads above it covering it, or everything with no url
+    def invalidate(self, url=None):
+        with self._lock:
+            if url is None:
+                keys = None
+                self._entries.clear()
+            else:
+                path = _path(url)
+                keys = [key for key in self._entries if _covers(key, path)]
+                for key in keys:
+                    del self._entries[key]
+        if self.store is not None and keys != []:
+            self.store.forget_objects(keys)
+
+    def _forget(self, key, future):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] is future:
+                del self._entries[key]
+
+
+def _path(url):
+    return url.strip().strip('/')
+
+
+# The MEMBER_ATTRS attribute a url reads/writes, None for any other url
+def _member_attr(path):
+    attr = path.rsplit('/', 1)[-1]
+    return attr if attr in MEMBER_ATTRS else None
+
+
+# True if the cached read (path, params) returns anything written to path.  A read at or below the path always does,
+# a read above it unless the write is to a member attribute the read's 'fields' leave out.
+def _covers(key, path):
+    read = key[0]
+    if read == path or read.startswith(path + '/'):
+        return True
+    if not path.startswith(read + '/'):
+        return False
+    fields = _fields(key[1])
+    attr = _member_attr(path)
+    return attr is None or fields is None or attr in fields
+
+
+# The 'fields' of a GET's cache key params, None if the GET returns every field
+def _fields(params):
+    args, kwargs = json.loads(params)
+    for data in [kwargs] + [kwargs.get('data')] + list(args[:1]):
+        if isinstance(data, dict) and data.get('fields') is not None:
+            return set(data['fields'])
+    return None
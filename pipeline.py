@@ -0,0 +1,726 @@
+import io
+import sys
+import threading
+import time
+from collections import Counter, deque
+from contextlib import contextmanager, nullcontext
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from pprint import pprint
+
+from modeldevice import *
+from eventlog import DEVICE_ERROR, STEP_SKIP, STEP_START
+from fleet import ModelDeviceFleet, OWNED, NOT_FOUND, SN_MISMATCH, NO_SERIAL
+
+# Why a step is skipped for a device (see RunContext.skip_reason), as printed
+SKIP_DONE = 'already done'
+SKIP_NO_CHANGE = 'no change needed'
+
+# (code, message) of the last result checked by the step running on this thread, for the event log
+_step_result = threading.local()
+
+
+def _note_result(code, msg):
+    _step_result.value = (code, msg)
+
+
+# fmg_msg is the message returned by FMG, recorded for the event log when md_msg is only for the printed output
+def check_result(md_code, md_msg, fmg_msg=None):
+    _note_result(md_code, fmg_msg if fmg_msg is not None or md_msg == 'ABORT' else md_msg)
+    if md_msg == 'ABORT':
+        md_msg = '!!! Aborting configuration of this device.'
+
+    if md_code == 0:
+        print('Success')
+        return True
+    else:
+        print(f'Failed: {md_msg}')
+        return False
+
+
+# Steps that are skipped for a device whose yaml leaves the object unset (or 'none'), and the attribute checked
+OPTIONAL_STEPS = {
+    'add_to_pre_cli': 'pre_cli_template',
+    'add_to_sdwan_templ': 'sdwan_template',
+}
+
+
+def _optional_step_skipped(md, name):
+    value = getattr(md, OPTIONAL_STEPS[name])
+    return value is None or str(value).lower() == 'none'
+
+
+# Each step function runs one stage of the model device pipeline for a single device.  Return True to continue to
+# the next step, False to abort further configuration of this device.
+def _step_delete_device(md, args):
+    print(f' Delete device: ', end='')
+    code, msg = md.delete()
+    check_result(code, msg)
+    return True
+
+
+def _step_check_fmg_script(md, args):
+    print(f' Checking if script: {md.fmg_script} exists')
+    pprint(md.check_fmg_script())
+    return True
+
+
+def _step_add_model_device(md, args):
+    print(f'  Adding model device {md.name}: ', end=' ')
+    try:
+        code, msg = md.add()
+    # Catch exception from ModelDevice for if the sn or name already exists in FMG DVM and then handle
+    except MdFmgDvmError as e:
+        if args.ignore_dev_exists:
+            print(f'\n    {e}, Continuing with configurations due to "ignore_dev_exists" flag set')
+            _note_result(0, str(e))
+        else:
+            print(f'\n    {e}, Abort further configuration of this device')
+            _note_result(1, str(e))
+            return False
+    # Catch exception from ModelDevice for if not enough variables provided to add device
+    except MdDataError as e:
+        print(f'\n    {e}, Aborting further configuration of this device')
+        _note_result(1, str(e))
+        return False
+    # No exceptions, so continue as normal
+    else:
+        if not check_result(code, 'ABORT', msg):
+            return False
+    return True
+
+
+def _step_add_meta_vars_map(md, args):
+    if args.fmg_ver < 720:
+        return True
+    print(f'  Adding metadata variable mappings: ', end=' ')
+    code, msg = md.add_fmg_meta_vars_mapping()
+    return check_result(code, 'ABORT', msg)
+
+
+# Add model device (already in DVM) to pre-run cli template
+def _step_add_to_pre_cli(md, args):
+    if _optional_step_skipped(md, 'add_to_pre_cli'):
+        return True
+    print(f'  Adding {md.name} to pre-run CLI template \"{md.pre_cli_template}\": ', end=' ')
+    code, msg = md.add_to_pre_cli_script()
+    return check_result(code, 'ABORT', msg)
+
+
+# Install Device Settings (Quick DB Install)
+def _step_install_device_db_pre(md, args):
+    print(f'  Install (Quick Install) to Device DB for pre-run CLI template: ', end=' ')
+    code, msg = md.install_device_db()
+    return check_result(code, 'ABORT', msg)
+
+
+# Assign model device to post-run CLI template group
+def _step_add_to_cli_templ_group(md, args):
+    print(f'  Add {md.name} to CLI Template Group \"{md.cli_template_group}\": ', end=' ')
+    code, msg = md.add_to_cli_templ_group()
+    return check_result(code, 'ABORT', msg)
+
+
+# Install Device Settings (Quick DB Install)
+def _step_install_device_db_cli(md, args):
+    print(f'  Install (Quick Install) to Device DB for post-run CLI templates: ', end=' ')
+    code, msg = md.install_device_db()
+    return check_result(code, 'ABORT', msg)
+
+
+# Add device to DVM Group
+def _step_add_to_dev_group(md, args):
+    print(f'  Add {md.name} to FMG Device Group \"{md.group}\": ', end=' ')
+    code, msg = md.add_to_dev_group()
+    return check_result(code, 'ABORT', msg)
+
+
+# Add device to SDWAN Template
+def _step_add_to_sdwan_templ(md, args):
+    if _optional_step_skipped(md, 'add_to_sdwan_templ'):
+        return True
+    print(f'  Add {md.name} to SDWAN Template \"{md.sdwan_template}\": ', end=' ')
+    code, msg = md.add_to_sdwan_templ()
+    return check_result(code, 'ABORT', msg)
+
+
+# Assign model device to general template groups (not cli)
+def _step_add_to_templ_group(md, args):
+    print(f'  Add {md.name} to Template Group \"{md.template_group}\": ', end=' ')
+    code, msg = md.add_to_templ_group()
+    return check_result(code, 'ABORT', msg)
+
+
+# Install Device Settings again, this time to add post run templates to DB
+def _step_install_device_db_post(md, args):
+    print(f'  Install (Quick Install) to Device DB for post-run CLI template/group: ', end=' ')
+    code, msg = md.install_device_db()
+    return check_result(code, 'ABORT', msg)
+
+
+# Assign model device to a policy package (not totally needed with being in group, but prefer indiv option)
+def _step_add_to_pol_pkg(md, args):
+    print(f'  Add {md.name} to Policy Package \"{md.policy_package}\": ', end=' ')
+    code, msg = md.add_to_pol_pkg()
+    return check_result(code, 'ABORT', msg)
+
+
+# Install Device Settings (hopefully this is quick DB install?)
+def _step_install_pol_pkg_to_db(md, args):
+    print(f'Install to DB Policy Package for device: ', end=' ')
+    code, msg = md.install_pol_pkg_to_db()
+    return check_result(code, 'ABORT', msg)
+
+
+# ModelDevice method run by each step, used to check each device's required settings up front
+STEP_METHODS = {
+    'delete_device': 'delete',
+    'check_fmg_script': 'check_fmg_script',
+    'add_model_device': 'add',
+    'add_meta_vars_map': 'add_fmg_meta_vars_mapping',
+    'add_to_pre_cli': 'add_to_pre_cli_script',
+    'install_device_db_pre': 'install_device_db',
+    'add_to_cli_templ_group': 'add_to_cli_templ_group',
+    'install_device_db_cli': 'install_device_db',
+    'add_to_dev_group': 'add_to_dev_group',
+    'add_to_sdwan_templ': 'add_to_sdwan_templ',
+    'add_to_templ_group': 'add_to_templ_group',
+    'install_device_db_post': 'install_device_db',
+    'add_to_pol_pkg': 'add_to_pol_pkg',
+    'install_pol_pkg_to_db': 'install_pol_pkg_to_db',
+}
+
+# Ordered pipeline.  Each step is enabled by the add_model_device.py argument of the same name.
+# Model device is finicky, so this order must be kept for each device.
+STEPS = [
+    ('delete_device', _step_delete_device),
+    ('check_fmg_script', _step_check_fmg_script),
+    ('add_model_device', _step_add_model_device),
+    ('add_meta_vars_map', _step_add_meta_vars_map),
+    ('add_to_pre_cli', _step_add_to_pre_cli),
+    ('install_device_db_pre', _step_install_device_db_pre),
+    ('add_to_cli_templ_group', _step_add_to_cli_templ_group),
+    ('install_device_db_cli', _step_install_device_db_cli),
+    ('add_to_dev_group', _step_add_to_dev_group),
+    ('add_to_sdwan_templ', _step_add_to_sdwan_templ),
+    ('add_to_templ_group', _step_add_to_templ_group),
+    ('install_device_db_post', _step_install_device_db_post),
+    ('add_to_pol_pkg', _step_add_to_pol_pkg),
+    ('install_pol_pkg_to_db', _step_install_pol_pkg_to_db),
+]
+
+
+# Steps each step needs completed before it can start, for running independent steps of a device at the same time
+# (see step_graph).  The Quick Installs are barriers: each one waits for every step before it and every step after
+# it waits for the install, so nothing runs alongside an install of the same device and the order the model device
+# needs is kept.  Between the barriers the steps only need the device to exist.
+STEP_DEPENDS = {
+    'delete_device': (),
+    'check_fmg_script': (),
+    'add_model_device': ('delete_device', 'check_fmg_script'),
+    'add_meta_vars_map': ('add_model_device',),
+    'add_to_pre_cli': ('add_model_device',),
+    'install_device_db_pre': ('add_meta_vars_map', 'add_to_pre_cli'),
+    'add_to_cli_templ_group': ('install_device_db_pre',),
+    'install_device_db_cli': ('add_to_cli_templ_group',),
+    'add_to_dev_group': ('install_device_db_cli',),
+    'add_to_sdwan_templ': ('install_device_db_cli',),
+    'add_to_templ_group': ('install_device_db_cli',),
+    'install_device_db_post': ('add_to_dev_group', 'add_to_sdwan_templ', 'add_to_templ_group'),
+    'add_to_pol_pkg': ('install_device_db_post',),
+    'install_pol_pkg_to_db': ('add_to_pol_pkg',),
+}
+
+
+def enabled_steps(args):
+    return [(name, func) for name, func in STEPS if getattr(args, name, False)]
+
+
+# Enabled steps as (name, func, set of the enabled steps it waits for) in pipeline order.  A dependency on a disabled
+# step is replaced by the dependencies of that step.
+def step_graph(args):
+    enabled = dict(enabled_steps(args))
+
+    def depends(name):
+        deps = set()
+        for dep in STEP_DEPENDS[name]:
+            deps.update([dep] if dep in enabled else depends(dep))
+        return deps
+
+    return [(name, func, depends(name)) for name, func in STEPS if name in enabled]
+
+
+# Most steps of one device that can be running at the same time
+def step_graph_width(args):
+    counts = Counter(frozenset(deps) for name, func, deps in step_graph(args))
+    return max(counts.values(), default=1)
+
+
+# (url, member) of the group/template/package a membership step assigns the device to, None for other steps and for
+# optional steps the device's yaml leaves unset
+def step_scope_member(md, name):
+    method = STEP_METHODS.get(name)
+    if method not in SCOPE_MEMBER_TARGETS:
+        return None
+    if name in OPTIONAL_STEPS and _optional_step_skipped(md, name):
+        return None
+    if getattr(md, SCOPE_MEMBER_TARGETS[method]) is None:
+        return None
+    return md.scope_member(method)
+
+
+# Run scoped helpers shared by every device in a run.  Each one is optional and is handed to every ModelDevice
+# (or ModelDeviceFleet) the pipeline creates.
+class RunContext:
+    def __init__(self, dvm_index=None, task_tracker=None, timer=None, journal=None, reconciler=None, events=None):
+        self.dvm_index = dvm_index
+        self.task_tracker = task_tracker
+        self.timer = timer
+        self.journal = journal
+        self.reconciler = reconciler
+        self.events = events
+        # Thread pool running the independent steps of a device at the same time (see step_graph), set by
+        # run_devices for --parallel_steps
+        self.step_pool = None
+
+    # Context manager timing one step (see timing.py), yields the timing record
+    def timed(self, fg, name):
+        if self.timer is None:
+            return nullcontext({})
+        return self.timer.step(fg, name)
+
+    # Add a record to the event log (see eventlog.py), if there is one
+    def event(self, event, **fields):
+        if self.events is not None:
+            self.events.emit(event, **fields)
+
+    # Context manager running one step of one device: timed, and reported to the event log as a step_start and a
+    # step_finish with the step's duration and the code/message of its result.  Yields the timing record, set
+    # record['ok'] to False for a failed step.
+    @contextmanager
+    def step(self, fg, name):
+        if self.events is not None:
+            self.events.step_start(fg, name)
+        _step_result.value = None
+        start = time.perf_counter()
+        try:
+            with self.timed(fg, name) as record:
+                yield record
+        except Exception as e:
+            self.step_finish(fg, name, False, time.perf_counter() - start, 1, str(e))
+            raise
+        code, msg = getattr(_step_result, 'value', None) or (0 if record['ok'] else 1, None)
+        self.step_finish(fg, name, record['ok'], time.perf_counter() - start, code, msg)
+
+    def step_finish(self, fg, name, ok, duration, code=None, msg=None):
+        if self.events is not None:
+            self.events.step_finish(fg, name, ok, duration, code, msg)
+
+    # SKIP_DONE if the step journal (see journal.py) shows an earlier run already completed this step for the device,
+    # SKIP_NO_CHANGE if the reconciler (see reconcile.py) found FMG already has what the step would do, else None.
+    # Skipped steps are reported to the event log.
+    def skip_reason(self, md, name):
+        if self.journal is not None and self.journal.completed(md.name, name, md.serial_num):
+            self.event(STEP_SKIP, device=md.name, step=name, reason='already done in an earlier run')
+            return SKIP_DONE
+        if self.reconciler is not None and not self.reconciler.needed(md, name):
+            self.event(STEP_SKIP, device=md.name, step=name, reason='FMG already up to date')
+            return SKIP_NO_CHANGE
+        return None
+
+    def step_completed(self, mds, name):
+        if self.journal is not None:
+            self.journal.record(name, [(md.name, md.serial_num) for md in mds])
+
+    # Raises MdDataError if a setting required by one of the enabled steps is missing
+    def model_device(self, fg, device, api, args):
+        # Create class instance of ModelDevice for this fg device to be added
+        # We provide the device info as 'dict' and the logged in fntlib api
+        device['name'] = fg   # assign name of device as var in dict
+        md = ModelDevice(device, api, args.fmg_ver)
+        md.validate(_required_methods(md, args))
+        md.dvm_index = self.dvm_index
+        md.task_tracker = self.task_tracker
+        md.events = self.events
+        return md
+
+    def fleet(self, mds, api, args):
+        fleet = ModelDeviceFleet(mds, api, args.batch_chunk_size)
+        fleet.task_tracker = self.task_tracker
+        fleet.dvm_index = self.dvm_index
+        return fleet
+
+
+def _required_methods(md, args):
+    methods = []
+    for name, step in enabled_steps(args):
+        if name in OPTIONAL_STEPS and _optional_step_skipped(md, name):
+            continue
+        methods.append(STEP_METHODS[name])
+    return methods
+
+
+# Run every enabled step for one device.  Returns True if the device made it through the whole pipeline.
+def onboard_device(fg, device, api, args, ctx=None):
+    ctx = RunContext() if ctx is None else ctx
+    print(f'<<<< Processing device: {fg} >>>>')
+    try:
+        md = ctx.model_device(fg, device, api, args)
+    except MdDataError as e:
+        print(f'    {e}, Aborting configuration of this device')
+        ctx.event(DEVICE_ERROR, device=fg, msg=str(e))
+        return False
+
+    if ctx.step_pool is not None:
+        return _run_step_graph(fg, md, args, ctx)
+
+    for name, step in enabled_steps(args):
+        reason = ctx.skip_reason(md, name)
+        if reason is not None:
+            print(f'  Step {name} {reason}, skipping')
+            continue
+        if not _run_step(fg, md, name, step, args, ctx):
+            return False
+    return True
+
+
+def _run_step(fg, md, name, step, args, ctx):
+    with ctx.step(fg, name) as record:
+        record['ok'] = step(md, args)
+    if record['ok']:
+        ctx.step_completed([md], name)
+    return record['ok']
+
+
+# Run the enabled steps of one device as soon as the steps they depend on (see STEP_DEPENDS) are done, steps ready
+# at the same time run on ctx.step_pool.  Output of each step is printed as one block when it finishes.  After a
+# step fails no further steps are started.  Returns True if every step completed.
+def _run_step_graph(fg, md, args, ctx):
+    # With a single worker nothing is capturing the output yet
+    installed = not isinstance(sys.stdout, _DeviceOutput)
+    out = _DeviceOutput(sys.stdout) if installed else sys.stdout
+    sys.stdout = out
+    try:
+        steps = step_graph(args)
+        done = set()
+        running = {}  # future -> step name
+        ok = True
+        while running or (ok and steps):
+            ready = [step for step in steps if step[2] <= done] if ok else []
+            steps = [step for step in steps if step not in ready]
+            for name, step, deps in ready:
+                reason = ctx.skip_reason(md, name)
+                if reason is not None:
+                    print(f'  Step {name} {reason}, skipping')
+                    done.add(name)
+                elif len(ready) == 1 and not running:
+                    if _run_step(fg, md, name, step, args, ctx):
+                        done.add(name)
+                    else:
+                        ok = False
+                else:
+                    running[ctx.step_pool.submit(_captured, out, _run_step, fg, md, name, step, args, ctx)] = name
+            if not running:
+                if not ready:
+                    break
+                continue
+
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                name = running.pop(future)
+                step_ok, text = future.result()
+                print(text, end='')
+                if step_ok:
+                    done.add(name)
+                else:
+                    ok = False
+    finally:
+        if installed:
+            sys.stdout = out.stream
+    return ok and not steps
+
+
+# sys.stdout stand-in that sends output of worker threads to a per-thread buffer so that each device's output can
+# be written out as one block instead of interleaving with other devices being processed at the same time
+class _DeviceOutput:
+    def __init__(self, stream):
+        self.stream = stream
+        self._local = threading.local()
+
+    def capture(self):
+        self._local.buffer = io.StringIO()
+
+    def release(self):
+        text = self._local.buffer.getvalue()
+        self._local.buffer = None
+        return text
+
+    def write(self, text):
+        buffer = getattr(self._local, 'buffer', None)
+        if buffer is not None:
+            return buffer.write(text)
+        return self.stream.write(text)
+
+    def flush(self):
+        self.stream.flush()
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+
+def _captured(out, func, *func_args):
+    out.capture()
+    try:
+        ok = func(*func_args)
+    except Exception as e:
+        # Keep an unexpected failure of one device from taking down the other devices in flight
+        print(f'\n    Unexpected error: {e}, Aborting further configuration of this device')
+        ok = False
+    return ok, out.release()
+
+
+# Call func(fg, *rest) for each (fg, *rest) tuple in items with up to 'workers' calls in flight.  Each call's output
+# is printed as one block in the order of items.  Returns dictionary of fg to the True/False returned by func.
+def _run_ordered(func, items, workers: int = 1):
+    results = {}
+    if workers <= 1:
+        for item in items:
+            results[item[0]] = func(*item)
+        return results
+
+    out = _DeviceOutput(sys.stdout)
+    sys.stdout = out
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            pending = deque()
+            for item in items:
+                pending.append((item[0], pool.submit(_captured, out, func, *item)))
+                # Bound the number of queued devices so large inventories are not all submitted up front
+                if len(pending) >= workers * 2:
+                    _write_next(pending, out, results)
+            while pending:
+                _write_next(pending, out, results)
+    finally:
+        sys.stdout = out.stream
+    return results
+
+
+def _write_next(pending, out, results):
+    fg, future = pending.popleft()
+    ok, text = future.result()
+    out.stream.write(text)
+    out.stream.flush()
+    results[fg] = ok
+
+
+# Run the pipeline for each (name, device dict) pair in devices.  With workers > 1, up to that many devices are in
+# flight at once, each still running its steps in order, and each device's output is printed as one block in
+# inventory order.  With args.parallel_steps the steps of a device that do not depend on each other (see
+# STEP_DEPENDS) run at the same time.  Returns dictionary of device name to True/False for pipeline completion.
+def run_devices(devices, api, args, workers: int = 1, ctx=None):
+    ctx = RunContext() if ctx is None else ctx
+    if not getattr(args, 'parallel_steps', False):
+        return _run_ordered(lambda fg, device: onboard_device(fg, device, api, args, ctx), devices, workers)
+
+    with ThreadPoolExecutor(max_workers=max(workers, 1) * step_graph_width(args)) as pool:
+        ctx.step_pool = pool
+        try:
+            return _run_ordered(lambda fg, device: onboard_device(fg, device, api, args, ctx), devices, workers)
+        finally:
+            ctx.step_pool = None
+
+
+# Batch implementations of pipeline steps.  Each takes a ModelDeviceFleet of the devices still in the pipeline and
+# returns dictionary of device name to (code, msg).
+def _batch_install_device_db(fleet, args):
+    return fleet.install_device_db()
+
+
+def _batch_meta_vars_map(fleet, args):
+    if args.fmg_ver < 720:
+        return {md.name: (0, None) for md in fleet.mds}
+    return fleet.add_fmg_meta_vars_mapping()
+
+
+# Devices whose yaml leaves the object unset (or 'none') are skipped, same as the per device steps
+def _batch_scope_members(method, optional=None):
+    def batch(fleet, args):
+        results = {}
+        mds = []
+        for md in fleet.mds:
+            if optional is not None and _optional_step_skipped(md, optional):
+                results[md.name] = (0, None)
+            else:
+                mds.append(md)
+        results.update(fleet.add_scope_members(method, mds))
+        return results
+    return batch
+
+
+BATCH_STEPS = {
+    'install_device_db_pre': _batch_install_device_db,
+    'install_device_db_cli': _batch_install_device_db,
+    'install_device_db_post': _batch_install_device_db,
+    'add_meta_vars_map': _batch_meta_vars_map,
+    'add_to_pre_cli': _batch_scope_members('add_to_pre_cli_script', optional='add_to_pre_cli'),
+    'add_to_cli_templ_group': _batch_scope_members('add_to_cli_templ_group'),
+    'add_to_dev_group': _batch_scope_members('add_to_dev_group'),
+    'add_to_sdwan_templ': _batch_scope_members('add_to_sdwan_templ', optional='add_to_sdwan_templ'),
+    'add_to_templ_group': _batch_scope_members('add_to_templ_group'),
+    'add_to_pol_pkg': _batch_scope_members('add_to_pol_pkg'),
+}
+
+
+# Names of the enabled steps that should run once for the whole fleet rather than once per device
+def batch_steps(args):
+    names = set()
+    if getattr(args, 'batch_install', False):
+        names.update(['install_device_db_pre', 'install_device_db_cli', 'install_device_db_post'])
+    if getattr(args, 'batch_meta_vars', False):
+        names.add('add_meta_vars_map')
+    if getattr(args, 'batch_members', False):
+        names.update(['add_to_pre_cli', 'add_to_cli_templ_group', 'add_to_dev_group', 'add_to_sdwan_templ',
+                      'add_to_templ_group', 'add_to_pol_pkg'])
+    return names
+
+
+# Run the pipeline one step at a time across all devices (instead of one device at a time through all steps) so
+# that steps named in batch can be sent to FMG for many devices per request/task.  Non batch steps run per device
+# with up to 'workers' devices in flight.  A device that fails a step is dropped from the following steps, a device
+# the journal or reconciler shows already done with a step skips just that step.
+def run_staged(devices, api, args, workers: int = 1, ctx=None, batch=None):
+    ctx = RunContext() if ctx is None else ctx
+    batch = batch_steps(args) if batch is None else batch
+    mds = {}
+    results = {}
+    for fg, device in devices:
+        try:
+            mds[fg] = ctx.model_device(fg, device, api, args)
+            results[fg] = True
+        except MdDataError as e:
+            print(f'  {fg}:     {e}, Aborting configuration of this device')
+            ctx.event(DEVICE_ERROR, device=fg, msg=str(e))
+            mds[fg] = None
+            results[fg] = False
+
+    for name, step in enabled_steps(args):
+        alive = [fg for fg in mds if results[fg]]
+        if not alive:
+            break
+        reasons = {fg: ctx.skip_reason(mds[fg], name) for fg in alive}
+        alive = [fg for fg in alive if reasons[fg] is None]
+        skipped = Counter(reason for reason in reasons.values() if reason is not None)
+        if skipped:
+            counts = ', '.join(f'{skipped[reason]} {reason}' for reason in (SKIP_DONE, SKIP_NO_CHANGE)
+                               if skipped[reason])
+            print(f'<<<< Step {name} for {len(alive)} devices ({counts}) >>>>')
+            if not alive:
+                print()
+                continue
+        else:
+            print(f'<<<< Step {name} for {len(alive)} devices >>>>')
+        ctx.event(STEP_START, device=None, step=name, devices=len(alive), batch=name in batch)
+
+        if name in batch:
+            fleet = ctx.fleet([mds[fg] for fg in alive], api, args)
+            start = time.perf_counter()
+            with ctx.timed(f'(batch of {len(alive)})', name):
+                try:
+                    outcome = BATCH_STEPS[name](fleet, args)
+                except MdDataError as e:
+                    print(f'    {e}, Aborting further configuration of these devices')
+                    outcome = {fg: (1, e) for fg in alive}
+            elapsed = time.perf_counter() - start
+            for fg in alive:
+                print(f'  {fg}: ', end=' ')
+                code, msg = outcome.get(fg, (1, 'No result returned'))
+                results[fg] = check_result(code, msg)
+                ctx.step_finish(fg, name, results[fg], elapsed, code, msg)
+            ctx.step_completed([mds[fg] for fg in alive if results[fg]], name)
+        else:
+            def run_step(fg):
+                print(f' {fg}:', end='')
+                with ctx.step(fg, name) as record:
+                    record['ok'] = step(mds[fg], args)
+                if record['ok']:
+                    ctx.step_completed([mds[fg]], name)
+                return record['ok']
+            results.update(_run_ordered(run_step, [(fg,) for fg in alive], workers))
+        print()
+    return results
+
+
+# Outcomes of run_fleet_delete, in the order they are reported
+REMOVED = 'removed'
+DELETE_FAILED = 'failed'
+INVALID = 'invalid'
+DELETE_OUTCOMES = {
+    REMOVED: 'removed',
+    NOT_FOUND: 'not in FMG (nothing to do)',
+    SN_MISMATCH: 'name in FMG with another serial number (not deleted)',
+    NO_SERIAL: 'no serial_num in the inventory to check ownership with (not deleted)',
+    DELETE_FAILED: 'delete failed',
+    INVALID: 'inventory entry missing a required setting (not deleted)',
+}
+
+
+# Remove every inventory device from FMG DVM.  Ownership of all device names is checked with one bulk DVM read, the
+# devices found with the inventory's serial number are deleted with one task per chunk of devices (tracked together)
+# and the rest are left alone.  Prints one summary at the end.  Returns dictionary of device name to (outcome,
+# detail), outcome being one of DELETE_OUTCOMES.
+def run_fleet_delete(devices, api, args, ctx=None):
+    ctx = RunContext() if ctx is None else ctx
+    outcome = {}
+    mds = []
+    for fg, device in devices:
+        device['name'] = fg
+        try:
+            mds.append(ModelDevice(device, api, args.fmg_ver, validate_for=['delete']))
+        except MdDataError as e:
+            outcome[fg] = (INVALID, str(e))
+
+    print(f'<<<< Fleet delete: checking ownership of {len(mds)} devices in FMG DVM >>>>')
+    fleet = ctx.fleet(mds, api, args)
+    try:
+        owners = fleet.ownership()
+    except MdFmgDvmError as e:
+        print(f'  {e}, aborting.')
+        return {md.name: (DELETE_FAILED, str(e)) for md in mds}
+
+    to_delete = []
+    for md in mds:
+        status, sn = owners[md.name]
+        if status == OWNED:
+            to_delete.append(md)
+        elif status == SN_MISMATCH:
+            outcome[md.name] = (status, f'FMG has serial number {sn}, inventory has {md.serial_num}')
+        elif status == NO_SERIAL:
+            outcome[md.name] = (status, f'FMG has serial number {sn}')
+        else:
+            outcome[md.name] = (status, None)
+
+    print(f'<<<< Fleet delete: deleting {len(to_delete)} devices >>>>')
+    ctx.event(STEP_START, device=None, step='delete_device', devices=len(to_delete), batch=True)
+    start = time.perf_counter()
+    results = fleet.delete(to_delete) if to_delete else {}
+    elapsed = time.perf_counter() - start
+    for md in to_delete:
+        code, msg = results.get(md.name, (1, 'No result returned'))
+        outcome[md.name] = (REMOVED, None) if code == 0 else (DELETE_FAILED, msg)
+        ctx.step_finish(md.name, 'delete_device', code == 0, elapsed, code, msg)
+
+    print_delete_summary(outcome)
+    return outcome
+
+
+def print_delete_summary(outcome):
+    counts = Counter(status for status, detail in outcome.values())
+    print(f'\n<<<< Fleet delete summary: {len(outcome)} devices >>>>')
+    for status, text in DELETE_OUTCOMES.items():
+        if counts[status]:
+            print(f'  {counts[status]:>6}  {text}')
+    for status in (SN_MISMATCH, NO_SERIAL, DELETE_FAILED, INVALID):
+        problems = [(fg, detail) for fg, (s, detail) in outcome.items() if s == status]
+        if problems:
+            print(f'  {DELETE_OUTCOMES[status]}:')
+            for fg, detail in problems:
+                print(f'    {fg}: {detail}')
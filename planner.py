@@ -0,0 +1,211 @@
+import csv
+import itertools
+import json
+import threading
+import time
+from collections import Counter
+from pyFMG.fortimgr import FortiManager
+from ratelimit import TASK_URLS
+
+# Step name for calls made outside of any pipeline step (reference check, reconcile reads, ...)
+OUTSIDE_STEPS = '(outside of steps)'
+
+# Latencies used when neither a timing file nor the plan's own reads measured one
+DEFAULT_CALL_LATENCY = 0.2
+DEFAULT_TASK_TIME = 5.0
+
+# Keys whose values are replaced in the --plan_out file, it would otherwise hold every device's passwords
+SECRET_KEYS = ('adm_pass', 'psk', 'passwd', 'password')
+
+
+# Dry-run stand-in for the FortiManager api object (plan mode).  Every call the pipeline makes is recorded against
+# the device and step it was made for (taken from the StepTimer) instead of being sent: writes are answered with
+# success, calls that would start an FMG task with a new task id and track_task() with a finished task.  Reads are
+# recorded as well and then answered by read_api (FMG, or the object cache/snapshot in front of it), single device
+# name/sn lookups from dvm_index when there is one, or with an empty result when there is neither.  With output the
+# JSON-RPC params of every call are written to that file as JSON lines, the exact request plan (SECRET_KEYS masked).
+class PlanApi:
+    def __init__(self, read_api=None, timer=None, dvm_index=None, output=None):
+        self.api = read_api
+        self.timer = timer
+        self.dvm_index = dvm_index
+        self.calls = Counter()  # (step, 'read' or 'write') -> calls
+        self.tasks = Counter()  # step -> FMG tasks started
+        self.targets = Counter()  # (method, url) -> calls
+        self.entries = Counter()  # (method, url) -> data entries sent (devices, members, mappings)
+        self.reads_sent = 0  # reads answered by read_api, and the time they took
+        self.read_time = 0.0
+        self._task_ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._output = open(output, 'w', encoding='utf-8') if output else None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def get(self, url, *args, **kwargs):
+        params = self._record('get', url, args, kwargs)
+        answer = self._dvm_lookup(params)
+        if answer is not None:
+            return answer
+        if self.api is None:
+            return 0, []
+        start = time.perf_counter()
+        try:
+            return self.api.get(url, *args, **kwargs)
+        finally:
+            with self._lock:
+                self.reads_sent += 1
+                self.read_time += time.perf_counter() - start
+
+    def add(self, url, *args, **kwargs):
+        return self._write('add', url, args, kwargs)
+
+    def set(self, url, *args, **kwargs):
+        return self._write('set', url, args, kwargs)
+
+    def update(self, url, *args, **kwargs):
+        return self._write('update', url, args, kwargs)
+
+    def delete(self, url, *args, **kwargs):
+        return self._write('delete', url, args, kwargs)
+
+    def execute(self, url, *args, **kwargs):
+        return self._write('execute', url, args, kwargs)
+
+    # Multi-param request, answered like FortiManager.free_form() with a status per params entry
+    def free_form(self, method, **kwargs):
+        params = kwargs.get('data') or []
+        if method == 'get':
+            for entry in params:
+                self._record('get', entry.get('url', ''), (), {}, entry)
+            return self.api.free_form(method, **kwargs) if self.api is not None else (200, [])
+
+        results = []
+        for entry in params:
+            url = entry.get('url', '')
+            task = method in ('exec', 'execute') and _path(url).startswith(TASK_URLS)
+            self._record(method, url, (), {}, entry, task)
+            result = {'status': {'code': 0, 'message': 'OK'}, 'url': url}
+            if task:
+                result['data'] = {'taskid': next(self._task_ids)}
+            results.append(result)
+        return 200, results
+
+    def track_task(self, task_id, **kwargs):
+        return 0, {'id': task_id, 'percent': 100, 'num_err': 0, 'num_warn': 0, 'line': []}
+
+    def close(self):
+        if self._output is not None:
+            self._output.close()
+            self._output = None
+
+    def _write(self, method, url, args, kwargs):
+        task = method == 'execute' and _path(url).startswith(TASK_URLS)
+        self._record(method, url, args, kwargs, task=task)
+        if task:
+            return 0, {'taskid': next(self._task_ids)}
+        return 0, {'status': {'code': 0, 'message': 'OK'}, 'url': url}
+
+    # Record one call, returns its JSON-RPC params
+    def _record(self, method, url, args, kwargs, params=None, task=False):
+        if params is None:
+            params = FortiManager.common_datagram_params(method, url, *args, **dict(kwargs))[0]
+        record = self.timer.current() if self.timer is not None else None
+        step = record['step'] if record is not None else OUTSIDE_STEPS
+        data = params.get('data')
+        target = (method, _path(url))
+        with self._lock:
+            self.calls[(step, 'read' if method == 'get' else 'write')] += 1
+            self.targets[target] += 1
+            self.entries[target] += len(data) if isinstance(data, list) else 1
+            if task:
+                self.tasks[step] += 1
+            if self._output is not None:
+                self._output.write(json.dumps({'device': record['device'] if record is not None else None,
+                                               'step': step, 'method': method, 'task': task,
+                                               'params': _masked(params)},
+                                              default=str) + '\n')
+        return params
+
+    # ModelDevice's single device name/sn lookups (see check_dev_name_in_fmg), answered from dvm_index
+    def _dvm_lookup(self, params):
+        if self.dvm_index is None or not self.dvm_index.loaded or _path(params['url']) != 'dvmdb/device':
+            return None
+        data_filter = params.get('filter')
+        if (not isinstance(data_filter, list) or len(data_filter) != 1 or not isinstance(data_filter[0], list)
+                or len(data_filter[0]) != 3 or data_filter[0][1] != '=='):
+            return None
+        field, op, value = data_filter[0]
+        if field == 'name':
+            found = self.dvm_index.name_exists(value)
+            return 0, [{'name': value, 'sn': self.dvm_index.sn_by_name[value]}] if found else []
+        if field == 'sn':
+            found = self.dvm_index.sn_exists(value)
+            return 0, [{'name': self.dvm_index.name_by_sn[value], 'sn': value}] if found else []
+        return None
+
+
+# Raw per step records of an earlier run, as written by StepTimer.write() (--timing_out, CSV or JSON)
+def load_timings(path):
+    with open(path, newline='') as f:
+        if path.lower().endswith('.csv'):
+            return list(csv.DictReader(f))
+        return json.load(f)
+
+
+# {step: (seconds per API call, seconds per FMG task)} measured in timing records, with the averages over every step
+# under None.  Either value is None when the records have no calls/tasks for the step.
+def measured_latencies(records):
+    sums = {}  # step -> [calls, call time, task waits, task wait time]
+    for rec in records:
+        for step in (rec['step'], None):
+            s = sums.setdefault(step, [0, 0.0, 0, 0.0])
+            s[0] += int(rec['requests'])
+            s[1] += float(rec['request_time'])
+            s[2] += int(rec['task_waits'])
+            s[3] += float(rec['task_wait'])
+    return {step: (s[1] / s[0] if s[0] else None, s[3] / s[2] if s[2] else None) for step, s in sums.items()}
+
+
+# Per step rows of (step, runs, reads, writes, tasks, estimated seconds) and the estimated (serial, concurrent) wall
+# time of the planned run, 'records' being the plan's StepTimer records (one per device, or batch, per step).  Each
+# step's calls and tasks are costed at the step's measured latencies, falling back to
+# the overall measured ones and then to call_latency/task_time.  Serial is the sum over every step, concurrent
+# spreads each step's cost over min(workers, runs of the step), so a batch step (one run for the whole fleet) is not
+# shortened by more workers.  FMG slowing down under the extra load is not taken into account.
+def estimate(plan, records, workers, latencies=None, call_latency=DEFAULT_CALL_LATENCY,
+             task_time=DEFAULT_TASK_TIME):
+    runs = Counter(rec['step'] for rec in records)
+    latencies = latencies or {}
+    overall = latencies.get(None, (None, None))
+    steps = list(dict.fromkeys([step for step, kind in plan.calls] + list(plan.tasks)))
+    rows = []
+    serial = 0.0
+    concurrent = 0.0
+    for step in steps:
+        measured = latencies.get(step, (None, None))
+        per_call = next(v for v in (measured[0], overall[0], call_latency) if v is not None)
+        per_task = next(v for v in (measured[1], overall[1], task_time) if v is not None)
+        reads = plan.calls[(step, 'read')]
+        writes = plan.calls[(step, 'write')]
+        seconds = (reads + writes) * per_call + plan.tasks[step] * per_task
+        step_runs = runs.get(step, 1)
+        rows.append((step, step_runs, reads, writes, plan.tasks[step], seconds))
+        serial += seconds
+        concurrent += seconds / max(min(workers, step_runs), 1)
+    return rows, serial, concurrent
+
+
+def _masked(value):
+    if isinstance(value, dict):
+        return {k: '***' if k in SECRET_KEYS and v else _masked(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_masked(v) for v in value]
+    return value
+
+
+def _path(url):
+    return url.strip().strip('/')
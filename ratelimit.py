@@ -0,0 +1,211 @@
+import threading
+import time
+
+# Calls that start FMG tasks (installs, DVM device add/delete).  They are also held back while FMG has max_tasks
+# tasks running.
+TASK_URLS = ('securityconsole/install', 'dvm/cmd')
+
+# FMG status codes treated as FMG being overloaded (-1 is 'internal error'), along with exceptions from the request
+CONGESTION_CODES = (-1,)
+
+
+# Adaptive concurrency limit (AIMD) for the API calls of the pipeline, wrapping a FortiManager api object (or any of
+# the other api wrappers).  At most 'limit' calls are in flight at once.  Every call that comes back without a sign
+# of congestion raises the limit by increase/limit (so by 'increase' per limit's worth of calls), a congested call
+# multiplies it by 'decrease', at most once per cooldown.  Congestion is: an exception or a CONGESTION_CODES status,
+# a response slower than target_latency (or, when 0, slower than 3x the fastest response seen for that method), or
+# FMG having max_tasks or more tasks outstanding.  The outstanding task count is read from FMG's task list by a
+# background thread every task_poll seconds (sooner, down to every MIN_TASK_POLL seconds, while calls are waiting for
+# it), and calls that would start another task wait while it is at max_tasks.  A call waits on the task count for at
+# most task_wait seconds and is then let through, and after MAX_FAILED_POLLS task list reads in a row fail the count
+# is dropped, so a task list FMG will not return cannot hold the run up.
+class AdaptiveLimiter:
+    LATENCY_FACTOR = 3
+    LATENCY_FLOOR = 0.05
+    MIN_TASK_POLL = 0.1
+    MAX_FAILED_POLLS = 3
+
+    def __init__(self, fmg_api, initial: int = 4, min_limit: int = 1, max_limit: int = 64, target_latency: float = 0.0,
+                 max_tasks: int = 20, task_poll: float = 2.0, increase: float = 1.0, decrease: float = 0.5,
+                 cooldown: float = 1.0, task_wait: float = 300):
+        self.api = fmg_api
+        self.min_limit = max(min_limit, 1)
+        self.max_limit = max(max_limit, self.min_limit)
+        self.limit = float(min(max(initial, self.min_limit), self.max_limit))
+        self.target_latency = target_latency
+        self.max_tasks = max_tasks
+        self.task_poll = task_poll
+        self.increase = increase
+        self.decrease = decrease
+        self.cooldown = cooldown
+        self.task_wait = task_wait
+        self.outstanding_tasks = 0
+        self.failed_polls = 0  # task list reads failed in a row
+        self.task_wait_timeouts = 0  # calls let through after waiting task_wait seconds on the task count
+        self.decreases = 0
+        self.waits = 0
+        self.peak_limit = self.limit
+        self.low_limit = self.limit
+        self._in_flight = 0
+        self._started_since_poll = 0
+        self._fastest = {}  # method -> fastest response seen
+        self._last_decrease = 0.0
+        self._cond = threading.Condition()
+        self._thread = None
+        self._stopped = threading.Event()
+        self._poll_now = threading.Event()
+
+    def __getattr__(self, name):
+        return getattr(self.api, name)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def start(self):
+        if self._thread is None and self.max_tasks > 0:
+            self._stopped.clear()
+            self._thread = threading.Thread(target=self._run, name='fmg-task-monitor', daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        self._poll_now.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def get(self, url, *args, **kwargs):
+        # Task polling is never held back, the calls waiting on a slot may be the ones waiting on those tasks
+        if _path(url).startswith('task/'):
+            return self.api.get(url, *args, **kwargs)
+        return self._call('get', url, *args, **kwargs)
+
+    def add(self, url, *args, **kwargs):
+        return self._call('add', url, *args, **kwargs)
+
+    def set(self, url, *args, **kwargs):
+        return self._call('set', url, *args, **kwargs)
+
+    def update(self, url, *args, **kwargs):
+        return self._call('update', url, *args, **kwargs)
+
+    def delete(self, url, *args, **kwargs):
+        return self._call('delete', url, *args, **kwargs)
+
+    def execute(self, url, *args, **kwargs):
+        return self._call('execute', url, *args, **kwargs)
+
+    def free_form(self, method, **kwargs):
+        params = kwargs.get('data') or [{}]
+        url = params[0].get('url', '') if isinstance(params[0], dict) else ''
+        if method == 'get' and _path(url).startswith('task/'):
+            return self.api.free_form(method, **kwargs)
+        return self._call('free_form', method, url=url, **kwargs)
+
+    def _call(self, method, *args, url=None, **kwargs):
+        url = args[0] if url is None else url
+        starts_task = method in ('execute', 'free_form') and _path(url).startswith(TASK_URLS)
+        self._acquire(starts_task)
+        start = time.perf_counter()
+        try:
+            result = getattr(self.api, method)(*args, **kwargs)
+        except Exception:
+            self._release(method, None, True)
+            raise
+        code = result[0] if isinstance(result, tuple) else None
+        self._release(method, time.perf_counter() - start, code in CONGESTION_CODES)
+        return result
+
+    def _acquire(self, starts_task):
+        with self._cond:
+            waited = False
+            held = starts_task and self.max_tasks > 0
+            deadline = time.monotonic() + self.task_wait
+            while True:
+                task_held = held and self.outstanding_tasks + self._started_since_poll >= self.max_tasks
+                if task_held and time.monotonic() >= deadline:
+                    # FMG's task count has not come down in time, let the call through rather than hang the run
+                    self.task_wait_timeouts += 1
+                    held = task_held = False
+                if self._in_flight < int(self.limit) and not task_held:
+                    break
+                waited = True
+                if task_held:
+                    self._poll_now.set()
+                self._cond.wait(0.5)
+            if waited:
+                self.waits += 1
+            self._in_flight += 1
+            if starts_task:
+                self._started_since_poll += 1
+
+    def _release(self, method, latency, congested):
+        with self._cond:
+            self._in_flight -= 1
+            if latency is not None:
+                fastest = min(self._fastest.get(method, latency), latency)
+                self._fastest[method] = fastest
+                threshold = self.target_latency
+                if threshold <= 0:
+                    threshold = max(fastest * self.LATENCY_FACTOR, self.LATENCY_FLOOR)
+                congested = congested or latency > threshold
+            if self.max_tasks > 0 and self.outstanding_tasks >= self.max_tasks:
+                congested = True
+
+            if congested:
+                self._decrease()
+            else:
+                self.limit = min(self.max_limit, self.limit + self.increase / self.limit)
+                self.peak_limit = max(self.peak_limit, self.limit)
+            self._cond.notify_all()
+
+    # Called holding _cond
+    def _decrease(self):
+        now = time.time()
+        if now - self._last_decrease < self.cooldown:
+            return
+        self._last_decrease = now
+        self.limit = max(self.min_limit, self.limit * self.decrease)
+        self.low_limit = min(self.low_limit, self.limit)
+        self.decreases += 1
+
+    # Background thread reading the number of tasks FMG has not finished yet
+    def _run(self):
+        data = {
+            'filter': ['percent', '<', 100],
+            'fields': ['id', 'percent']
+        }
+        while not self._stopped.is_set():
+            self._poll_now.clear()
+            with self._cond:
+                started = self._started_since_poll
+            try:
+                rcode, rmsg = self.api.get('/task/task', data)
+            except Exception:
+                rcode, rmsg = 1, None
+            with self._cond:
+                if rcode == 0:
+                    self.failed_polls = 0
+                    self.outstanding_tasks = len(rmsg) if isinstance(rmsg, list) else (1 if rmsg else 0)
+                    # Tasks started while the list was being read may not be in it yet
+                    self._started_since_poll -= started
+                    if self.outstanding_tasks >= self.max_tasks:
+                        self._decrease()
+                    self._cond.notify_all()
+                else:
+                    self.failed_polls += 1
+                    if self.failed_polls >= self.MAX_FAILED_POLLS:
+                        # The count can no longer come down, stop holding task starts back on it until a read works
+                        self.outstanding_tasks = 0
+                        self._started_since_poll = 0
+                        self._cond.notify_all()
+            self._stopped.wait(self.MIN_TASK_POLL)
+            self._poll_now.wait(self.task_poll - self.MIN_TASK_POLL)
+
+
+def _path(url):
+    return url.strip().strip('/')
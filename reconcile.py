@@ -0,0 +1,156 @@
+from modeldevice import *
+from dvmindex import DvmIndex
+from pipeline import step_scope_member
+
+# Steps that write to the device DB / policy package DB.  A device DB install is needed when any step since the
+# previous install made a change, the policy package install when any step made a change.  Both are also needed
+# while the device's DVM db_status shows changes no install has picked up yet, e.g. assignments made by an earlier
+# run that stopped before its install.
+DEVICE_DB_INSTALLS = ('install_device_db_pre', 'install_device_db_cli', 'install_device_db_post')
+POLICY_INSTALLS = ('install_pol_pkg_to_db',)
+
+# dvmdb device db_status of a device with nothing waiting to be installed ('nomod'), 0/'unknown' and 2/'mod' are not
+DB_STATUS_NOMOD = (1, 'nomod')
+
+
+# Desired-state reconcile.  Reads the current FMG state for the whole inventory once (DVM name/sn and db_status, the
+# member list of every referenced group/template/template group/policy package and the mappings of every metadata
+# variable, one GET per object) and works out which pipeline steps each device actually needs.  Steps that would not
+# change anything, and installs with nothing new to install, are then skipped by the pipeline (see
+# RunContext.skip_reason).
+class Reconciler:
+    def __init__(self, fmg_api=None, dvm_index: DvmIndex = None, fmg_ver: int = 70):
+        self.api = fmg_api
+        self.dvm_index = dvm_index
+        self.fmg_ver = fmg_ver
+        self.reads = 0
+        self.members = {}  # member url -> set of (name, vdom), None if it could not be read
+        self.mappings = {}  # variable dynamic_mapping url -> {device name: value}, None if it could not be read
+        self.db_status = {}  # device name -> DVM db_status, missing if it could not be read
+        self._needed = {}  # device name -> set of needed step names
+
+    # Read current state for the passed in ModelDevice objects and the enabled step names
+    def load(self, mds, steps):
+        mds = list(mds)
+        if self.dvm_index is None or not self.dvm_index.loaded:
+            self.dvm_index = DvmIndex(self.api).load_for([md.name for md in mds], [md.serial_num for md in mds])
+            self.reads += 1
+
+        # Only devices already in DVM have anything to read, a new device needs every step
+        existing = [md for md in mds if self.dvm_index.name_and_sn_same(md.name, md.serial_num)]
+        if existing and any(name in DEVICE_DB_INSTALLS + POLICY_INSTALLS for name in steps):
+            self._read_db_status([md.name for md in existing])
+        for md in existing:
+            for name in steps:
+                scope_member = step_scope_member(md, name)
+                if scope_member is not None and scope_member[0] not in self.members:
+                    self.members[scope_member[0]] = self._read_members(scope_member[0])
+            if 'add_meta_vars_map' in steps and self.fmg_ver >= 720 and md.meta_vars:
+                for var in md.meta_vars:
+                    url = f'/pm/config/adom/{md.adom}/obj/fmg/variable/{var}/dynamic_mapping'
+                    if url not in self.mappings:
+                        self.mappings[url] = self._read_mappings(url)
+
+        for md in mds:
+            self._needed[md.name] = self._needed_steps(md, steps)
+        return self
+
+    # True if the step has to run for the device
+    def needed(self, md, name):
+        needed = self._needed.get(md.name)
+        return needed is None or name in needed
+
+    # Number of devices with at least one change and the number of device steps skipped as already in place
+    def summary(self, steps):
+        changed = sum(1 for needed in self._needed.values() if needed)
+        skipped = sum(len(steps) - len(needed) for needed in self._needed.values())
+        return changed, skipped
+
+    def _read_db_status(self, names):
+        self.reads += 1
+        data = {
+            'filter': ['name', 'in', *names],
+            'fields': ['name', 'db_status']
+        }
+        rcode, rmsg = self.api.get('dvmdb/device/', data)
+        if rcode != 0:
+            return
+        if isinstance(rmsg, dict):
+            rmsg = [rmsg]
+        for rec in rmsg or []:
+            self.db_status[rec.get('name')] = rec.get('db_status')
+
+    def _read_members(self, url):
+        self.reads += 1
+        rcode, rmsg = self.api.get(url)
+        if rcode != 0:
+            return None
+        if isinstance(rmsg, dict):
+            rmsg = [rmsg]
+        return {(m.get('name'), m.get('vdom')) for m in rmsg or []}
+
+    def _read_mappings(self, url):
+        self.reads += 1
+        rcode, rmsg = self.api.get(url)
+        if rcode != 0:
+            return None
+        if isinstance(rmsg, dict):
+            rmsg = [rmsg]
+        mappings = {}
+        for mapping in rmsg or []:
+            scopes = mapping.get('_scope', [])
+            for scope in [scopes] if isinstance(scopes, dict) else scopes:
+                mappings[scope.get('name')] = str(mapping.get('value'))
+        return mappings
+
+    def _needed_steps(self, md, steps):
+        needed = set()
+        if not self.dvm_index.name_and_sn_same(md.name, md.serial_num):
+            # New device (or a name/sn conflict the add step reports), nothing to compare against
+            return set(steps)
+
+        changed = False
+        changed_since_install = False
+        # Changes waiting for an install that this run would not make again
+        pending = self.db_status.get(md.name) not in DB_STATUS_NOMOD
+        for name in steps:
+            if name in ('delete_device', 'check_fmg_script'):
+                # No state to compare, always run
+                needed.add(name)
+                continue
+            if name in DEVICE_DB_INSTALLS:
+                change = changed_since_install or pending
+                changed_since_install = False
+            elif name in POLICY_INSTALLS:
+                change = changed or pending
+            elif name == 'add_model_device':
+                change = False
+            elif name == 'add_meta_vars_map':
+                change = self._meta_vars_changed(md)
+            else:
+                change = not self._is_member(md, name)
+
+            if change:
+                needed.add(name)
+                changed = True
+                if name not in DEVICE_DB_INSTALLS:
+                    changed_since_install = True
+        return needed
+
+    # True if the device is already a member of what the step assigns it to (or the step has nothing to assign)
+    def _is_member(self, md, name):
+        scope_member = step_scope_member(md, name)
+        if scope_member is None:
+            return True
+        url, member = scope_member
+        members = self.members.get(url)
+        return members is not None and (member['name'], member['vdom']) in members
+
+    def _meta_vars_changed(self, md):
+        if self.fmg_ver < 720 or not md.meta_vars:
+            return False
+        for var, value in md.meta_vars.items():
+            mappings = self.mappings.get(f'/pm/config/adom/{md.adom}/obj/fmg/variable/{var}/dynamic_mapping')
+            if mappings is None or mappings.get(md.name) != str(value):
+                return True
+        return False
@@ -0,0 +1,93 @@
+from modeldevice import *
+from pipeline import STEP_METHODS, step_scope_member
+
+# Description used in the report for the ModelDevice attribute naming each referenced object
+REFERENCE_TYPES = {
+    'pre_cli_template': 'CLI template',
+    'cli_template_group': 'CLI template group',
+    'group': 'device group',
+    'sdwan_template': 'SDWAN template',
+    'template_group': 'template group',
+    'policy_package': 'policy package',
+    'meta_vars': 'metadata variable',
+}
+
+
+# Checks up front that every group, template, template group, policy package and metadata variable referenced by
+# the inventory exists in FMG.  The distinct object names are collected across all devices and looked up with one
+# filtered list request per object type and ADOM, so a typo is reported before any device is added instead of as
+# an FMG error part way through provisioning that device.
+class ReferenceCheck:
+    def __init__(self, fmg_api=None, fmg_ver: int = 70):
+        self.api = fmg_api
+        self.fmg_ver = fmg_ver
+        self.reads = 0
+
+    # Returns dictionary of (attribute, collection url, object name) to the list of device names referencing it, for
+    # every referenced object that does not exist (or whose collection could not be listed)
+    def check(self, mds, steps):
+        refs = {}  # collection url -> {object name: (attribute, [device names])}
+        for md in mds:
+            for name in steps:
+                scope_member = step_scope_member(md, name)
+                if scope_member is None:
+                    continue
+                attr = SCOPE_MEMBER_TARGETS[STEP_METHODS[name]]
+                # Member url is <collection>/<object name>/scope member (or object member), the name of a policy
+                # package inside a folder being folder/package
+                obj = str(getattr(md, attr))
+                object_url = scope_member[0].rsplit('/', 1)[0]
+                if object_url.endswith(f'/{obj}'):
+                    collection = object_url[:-len(obj) - 1]
+                else:
+                    collection = object_url.rsplit('/', 1)[0]
+                self._add_ref(refs, collection, obj, attr, md.name)
+            if 'add_meta_vars_map' in steps and self.fmg_ver >= 720 and md.meta_vars:
+                for var in md.meta_vars:
+                    self._add_ref(refs, f'/pm/config/adom/{md.adom}/obj/fmg/variable', var, 'meta_vars', md.name)
+
+        missing = {}
+        for collection, objects in refs.items():
+            existing = self._list_names(collection, list(objects))
+            for obj, (attr, devices) in objects.items():
+                if existing is None or obj not in existing:
+                    missing[(attr, collection, obj)] = devices
+        return missing
+
+    @staticmethod
+    def _add_ref(refs, collection, obj, attr, device):
+        refs.setdefault(collection, {}).setdefault(str(obj), (attr, []))[1].append(device)
+
+    # Names of the passed in objects that exist in the collection, None if the collection could not be listed
+    def _list_names(self, collection, names):
+        self.reads += 1
+        data = {}
+        # Policy packages are returned as a tree of folders (subobj), so the whole tree is listed and walked instead
+        if not collection.startswith('/pm/pkg/'):
+            data['fields'] = ['name']
+            data['filter'] = ['name', 'in', *names]
+        rcode, rmsg = self.api.get(collection, data)
+        if rcode != 0:
+            return None
+        if isinstance(rmsg, dict):
+            rmsg = [rmsg]
+        return set(_object_names(rmsg or []))
+
+
+# Names in an object list, folder/name for objects inside policy package folders
+def _object_names(objects, folder=''):
+    for obj in objects:
+        name = f'{folder}{obj.get("name")}'
+        yield name
+        if obj.get('subobj'):
+            yield from _object_names(obj['subobj'], f'{name}/')
+
+
+# One line per dangling reference for the report
+def reference_report(missing):
+    lines = []
+    for (attr, collection, obj), devices in sorted(missing.items()):
+        shown = ', '.join(devices[:5]) + (f' and {len(devices) - 5} more' if len(devices) > 5 else '')
+        lines.append(f'{REFERENCE_TYPES[attr]} "{obj}" ({collection}) not found, used by {len(devices)} '
+                     f'device(s): {shown}')
+    return lines
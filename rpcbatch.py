@@ -0,0 +1,130 @@
+import threading
+import time
+from concurrent.futures import Future
+
+
+# Request batching layer that sits between ModelDevice (or anything else calling get/add/execute...) and a logged
+# in pyFMG FortiManager object.  Calls from any number of threads are queued and flushed as one multi-param JSON-RPC
+# request per method once max_params calls are waiting or the oldest call has waited max_wait seconds.  Each
+# caller blocks until its own entry of the response comes back and gets the same (code, msg) that the FortiManager
+# method would have returned, so a RpcBatcher can be passed anywhere a FortiManager 'api' is expected.
+class RpcBatcher:
+    # pyFMG method name -> JSON-RPC method name
+    METHODS = {
+        'get': 'get',
+        'add': 'add',
+        'set': 'set',
+        'update': 'update',
+        'delete': 'delete',
+        'execute': 'exec',
+    }
+
+    def __init__(self, fmg_api, max_params: int = 20, max_wait: float = 0.05):
+        self.api = fmg_api
+        self.max_params = max_params if max_params > 0 else 1
+        self.max_wait = max_wait
+        self.requests_sent = 0
+        self.calls_sent = 0
+        self._queues = {}  # JSON-RPC method -> list of (params entry, future, time queued)
+        self._cond = threading.Condition()
+        self._thread = None
+        self._stopped = False
+
+    # Anything not batched (login, logout, track_task, free_form...) goes straight to the FortiManager object
+    def __getattr__(self, name):
+        return getattr(self.api, name)
+
+    def get(self, url, *args, **kwargs):
+        return self._call('get', url, *args, **kwargs)
+
+    def add(self, url, *args, **kwargs):
+        return self._call('add', url, *args, **kwargs)
+
+    def set(self, url, *args, **kwargs):
+        return self._call('set', url, *args, **kwargs)
+
+    def update(self, url, *args, **kwargs):
+        return self._call('update', url, *args, **kwargs)
+
+    def delete(self, url, *args, **kwargs):
+        return self._call('delete', url, *args, **kwargs)
+
+    def execute(self, url, *args, **kwargs):
+        return self._call('execute', url, *args, **kwargs)
+
+    def start(self):
+        if self._thread is None:
+            self._stopped = False
+            self._thread = threading.Thread(target=self._run, name='fmg-rpc-batcher', daemon=True)
+            self._thread.start()
+        return self
+
+    # Flush anything still queued and stop the flusher thread
+    def stop(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _call(self, method, url, *args, **kwargs):
+        # Build the params entry exactly as pyFMG would for a single request
+        params = self.api.common_datagram_params(method, url, *args, **kwargs)[0]
+        future = Future()
+        with self._cond:
+            queue = self._queues.setdefault(self.METHODS[method], [])
+            queue.append((params, future, time.time()))
+            if len(queue) == 1 or len(queue) >= self.max_params:
+                self._cond.notify_all()
+        self.start()
+        return future.result()
+
+    # Pick the method queue to flush next, or return how long to wait before one is due
+    def _due(self):
+        now = time.time()
+        wait = None
+        for method, queue in self._queues.items():
+            if not queue:
+                continue
+            age = now - queue[0][2]
+            if self._stopped or len(queue) >= self.max_params or age >= self.max_wait:
+                return method, 0
+            remaining = self.max_wait - age
+            wait = remaining if wait is None else min(wait, remaining)
+        return None, wait
+
+    def _run(self):
+        while True:
+            with self._cond:
+                method, wait = self._due()
+                while method is None:
+                    if self._stopped:
+                        return
+                    self._cond.wait(wait)
+                    method, wait = self._due()
+                queue = self._queues[method]
+                batch = queue[:self.max_params]
+                del queue[:self.max_params]
+            self._send(method, batch)
+
+    def _send(self, method, batch):
+        self.requests_sent += 1
+        self.calls_sent += len(batch)
+        try:
+            code, result = self.api.free_form(method, data=[params for params, future, queued in batch])
+        except Exception as e:
+            for params, future, queued in batch:
+                future.set_exception(e)
+            return
+
+        for n, (params, future, queued) in enumerate(batch):
+            if code != 200 or not isinstance(result, list) or n >= len(result):
+                future.set_result((code if code != 200 else 1, result))
+                continue
+            # Same demultiplexing as FortiManager._handle_response() does for a single request
+            entry = result[n]
+            if 'data' in entry:
+                future.set_result((entry['status']['code'], entry['data']))
+            else:
+                future.set_result((entry['status']['code'], entry))
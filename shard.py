@@ -0,0 +1,189 @@
+#! /usr/bin/python
+
+"""
+Sharded execution of add_model_device.py across several FortiManagers and ADOMs from a single inventory.
+
+Each device in the fgt_yaml file names its target FortiManager with 'fmg' (a name from the --fmgs file, devices
+without one go to --default_fmg) and its ADOM with 'adom' as usual, either of them possibly from its profile.
+Devices are partitioned by (fmg, adom) and every partition runs as its own add_model_device.py process, with its own
+login session and --workers budget, up to --parallel partitions at the same time, so total time follows the slowest
+partition rather than the sum of all of them.  One combined report of every device is printed at the end.
+
+--fmgs file:
+    fmg-east:
+      fmg_ip: 10.0.0.1
+      fmg_login: admin
+      fmg_pass_env: FMG_EAST_PASS    # name of the environment variable holding the password (or fmg_pass: ...)
+      fmg_ver: 744
+      workers: 8                     # --workers for each partition on this FMG
+
+Anything after '--' is passed through to every add_model_device.py process:
+    python shard.py --fgt_yaml fleet.yml --fmgs fmgs.yml --parallel 4 -- --batch_install True --task_tracker True
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import yaml
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from inventory import iter_inventory_file, iter_devices, device_setting, unresolved, InventoryProfiles
+
+SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'add_model_device.py')
+
+# add_model_device.py options naming an output file, given a per partition suffix so partitions do not share a file
+PER_SHARD_PATHS = ('--journal', '--timing_out', '--event_log', '--snapshot', '--plan_out')
+
+
+# Split the inventory into {(fmg name, adom): {device name: device}}.  Devices whose FMG is not in fmgs are returned
+# separately as {device name: reason}.
+def partition(devices, fmgs, default_fmg=None):
+    shards = {}
+    rejected = {}
+    for fg, device in devices:
+        fmg = device_setting(device, 'fmg', default_fmg)
+        if fmg is None:
+            rejected[fg] = 'no "fmg" set for device and no --default_fmg'
+        elif fmg not in fmgs:
+            rejected[fg] = f'fmg "{fmg}" not found in the --fmgs file'
+        else:
+            shards.setdefault((fmg, device_setting(device, 'adom', 'root')), {})[fg] = device
+    return shards, rejected
+
+
+# Command line and environment for the add_model_device.py process of one partition
+def shard_command(shard, fmg, inventory, results, script_args):
+    name = f'{shard[0]}_{shard[1]}'
+    cmd = [sys.executable, SCRIPT, '--fgt_yaml', inventory, '--results_out', results, '--fmg_ip', str(fmg['fmg_ip']),
+           '--fmg_login', str(fmg.get('fmg_login', 'admin')), '--get_device_info', '']
+    if 'fmg_ver' in fmg:
+        cmd += ['--fmg_ver', str(fmg['fmg_ver'])]
+    if 'workers' in fmg:
+        cmd += ['--workers', str(fmg['workers'])]
+
+    args = list(script_args)
+    for i, arg in enumerate(args[:-1]):
+        if arg in PER_SHARD_PATHS and args[i + 1] != '-':
+            root, ext = os.path.splitext(args[i + 1])
+            args[i + 1] = f'{root}.{name}{ext}'
+    cmd += args
+
+    # Password is handed over in the environment rather than on the command line where other users can see it
+    env = dict(os.environ)
+    if 'fmg_pass_env' in fmg:
+        env['FMG_PASS'] = os.environ.get(fmg['fmg_pass_env'], '')
+    elif 'fmg_pass' in fmg:
+        env['FMG_PASS'] = str(fmg['fmg_pass'])
+    return cmd, env
+
+
+# Run one partition, returns (shard, device results or None, seconds, log path, exit code).  'shared' holds the
+# _defaults/_profiles entries the devices refer to, written ahead of them in the partition's inventory.
+def run_shard(shard, devices, fmg, work_dir, log_dir, script_args, shared=None):
+    name = f'{shard[0]}_{shard[1]}'
+    inventory = os.path.join(work_dir, f'{name}.yml')
+    results = os.path.join(work_dir, f'{name}.json')
+    log = os.path.join(log_dir, f'{name}.log')
+    with open(inventory, 'w') as f:
+        entries = dict(shared or {})
+        entries.update((fg, unresolved(device)) for fg, device in devices.items())
+        yaml.safe_dump(entries, f, sort_keys=False)
+
+    cmd, env = shard_command(shard, fmg, inventory, results, script_args)
+    start = time.perf_counter()
+    with open(log, 'w') as out:
+        code = subprocess.run(cmd, env=env, stdout=out, stderr=subprocess.STDOUT).returncode
+    elapsed = time.perf_counter() - start
+
+    outcome = None
+    if os.path.exists(results):
+        with open(results) as f:
+            outcome = json.load(f)
+    return shard, outcome, elapsed, log, code
+
+
+def print_report(shards, runs, rejected, elapsed):
+    print(f'  {"shard":<30} {"devices":>8} {"completed":>10} {"failed":>7} {"seconds":>9}  log')
+    failed = dict(rejected)
+    total = len(rejected)
+    completed = 0
+    for shard, outcome, seconds, log, code in runs:
+        devices = shards[shard]
+        total += len(devices)
+        if outcome is None:
+            # The shard stopped before running the pipeline (login failure, reference check, ...)
+            for fg in devices:
+                failed[fg] = f'{shard[0]}/{shard[1]} did not run (exit code {code}), see {log}'
+            ok = 0
+        else:
+            ok = sum(1 for fg in devices if outcome.get(fg))
+            for fg in devices:
+                if not outcome.get(fg):
+                    failed[fg] = f'{shard[0]}/{shard[1]}, see {log}'
+        completed += ok
+        print(f'  {shard[0] + "/" + shard[1]:<30} {len(devices):>8} {ok:>10} {len(devices) - ok:>7} {seconds:>9.1f}  '
+              f'{log}')
+
+    slowest = max(runs, key=lambda run: run[2]) if runs else None
+    print(f'\n  {completed} of {total} devices completed in {elapsed:.1f} seconds'
+          + (f' (slowest shard {slowest[0][0]}/{slowest[0][1]}: {slowest[2]:.1f} seconds)' if slowest else ''))
+    if failed:
+        print(f'  {len(failed)} devices not completed:')
+        for fg, reason in failed.items():
+            print(f'    {fg}: {reason}')
+    return completed, total, failed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--fgt_yaml', default='fgt.yml')
+    parser.add_argument('--fmgs', default='fmgs.yml')  # FortiManagers the inventory's 'fmg' names refer to
+    parser.add_argument('--default_fmg')  # FMG for devices without 'fmg' set
+    parser.add_argument('--parallel', type=int, default=4)  # number of shards running at the same time
+    parser.add_argument('--log_dir', default='.')  # each shard's output goes to <log_dir>/<fmg>_<adom>.log
+    parser.add_argument('--report_out')  # write the combined device results as JSON
+    parser.add_argument('--profiles')  # yaml file of _defaults/_profiles settings shared by the devices
+    args, script_args = parser.parse_known_args()
+    script_args = [a for a in script_args if a != '--']
+
+    with open(args.fmgs) as f:
+        fmgs = yaml.safe_load(f) or {}
+    profiles = InventoryProfiles()
+    if args.profiles:
+        profiles.load(args.profiles)
+    shards, rejected = partition(iter_devices(iter_inventory_file(args.fgt_yaml), profiles), fmgs, args.default_fmg)
+    print(f'<<<< {sum(len(d) for d in shards.values())} devices in {len(shards)} shards, '
+          f'up to {args.parallel} at a time >>>>')
+    for shard, devices in shards.items():
+        print(f'  {shard[0]}/{shard[1]}: {len(devices)} devices')
+
+    start = time.perf_counter()
+    os.makedirs(args.log_dir, exist_ok=True)
+    with tempfile.TemporaryDirectory() as work_dir:
+        with ThreadPoolExecutor(max_workers=max(args.parallel, 1)) as pool:
+            futures = [pool.submit(run_shard, shard, devices, fmgs[shard[0]], work_dir, args.log_dir, script_args,
+                                   profiles.raw)
+                       for shard, devices in shards.items()]
+            runs = []
+            for future in as_completed(futures):
+                runs.append(future.result())
+                shard = runs[-1][0]
+                print(f'  Shard {shard[0]}/{shard[1]} finished in {runs[-1][2]:.1f} seconds')
+
+    print('\n<<<< Combined results >>>>')
+    completed, total, failed = print_report(shards, runs, rejected, time.perf_counter() - start)
+
+    if args.report_out:
+        report = {}
+        for shard, outcome, seconds, log, code in runs:
+            for fg in shards[shard]:
+                report[fg] = {'fmg': shard[0], 'adom': shard[1], 'completed': fg not in failed,
+                              'detail': failed.get(fg)}
+        for fg, reason in rejected.items():
+            report[fg] = {'fmg': None, 'adom': None, 'completed': False, 'detail': reason}
+        with open(args.report_out, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f'  Combined results written to {args.report_out}')
@@ -0,0 +1,121 @@
+import json
+import sqlite3
+import threading
+import time
+
+
+# On-disk snapshot of the FMG state the tool reads: the name/sn of every device in DVM and the ADOM objects read
+# through the object cache (see ObjectCache), so that a later run against the same FMG answers its checks locally.
+# Each part is used for max_age seconds after it was read from FMG.  After that only the stale part is read again:
+# the DVM index with one name/sn request whose differences to the snapshot are written back, an object when it is
+# next asked for.  Writes the tool makes itself keep the snapshot current (devices added/deleted are saved with the
+# index, reads of written objects are dropped, see ObjectCache), changes made on FMG by anyone else show up once
+# max_age has passed.
+class FmgSnapshot:
+    def __init__(self, path, fmg, max_age: float = 3600):
+        self.path = path
+        self.fmg = str(fmg)
+        self.max_age = max_age
+        # Plan mode writes nothing to FMG, so objects are not dropped from the snapshot for the writes it plans
+        self.dry_run = False
+        self.dvm_read = None  # time the DVM index in the snapshot was read from FMG
+        self.dvm_changes = 0  # devices added, removed or changed in the snapshot by the last save_index()
+        self._saved = {}  # device name -> sn, as in the database
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+        self._conn.execute('CREATE TABLE IF NOT EXISTS devices (name TEXT PRIMARY KEY, sn TEXT)')
+        self._conn.execute('CREATE TABLE IF NOT EXISTS objects (path TEXT NOT NULL, params TEXT NOT NULL, code '
+                           'INTEGER, msg TEXT, fetched REAL NOT NULL, PRIMARY KEY (path, params))')
+
+        meta = dict(self._conn.execute('SELECT key, value FROM meta'))
+        if meta.get('fmg') != self.fmg:
+            # Snapshot of another FMG (or a new file), nothing in it applies
+            self._execute([('DELETE FROM devices', ()), ('DELETE FROM objects', ()), ('DELETE FROM meta', ()),
+                           ('INSERT INTO meta (key, value) VALUES (?, ?)', ('fmg', self.fmg))])
+        elif meta.get('dvm_read') is not None:
+            self.dvm_read = float(meta['dvm_read'])
+            self._saved = dict(self._conn.execute('SELECT name, sn FROM devices'))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    # Seconds since the DVM index in the snapshot was read from FMG, None if it never was
+    def dvm_age(self):
+        return None if self.dvm_read is None else time.time() - self.dvm_read
+
+    # Fill the passed in DvmIndex from the snapshot, reading it from FMG first (index.load()) if the snapshot has none
+    # or it is older than max_age.  Returns True if the index was read from FMG.
+    def load_index(self, index):
+        age = self.dvm_age()
+        if age is not None and age <= self.max_age:
+            for name, sn in self._saved.items():
+                index.add_device(name, sn)
+            index.loaded = True
+            return False
+
+        index.load()
+        self.dvm_read = time.time()
+        self.save_index(index)
+        return True
+
+    # Write the differences between the index and the snapshot, e.g. the devices the run added or deleted.  Keeps the
+    # time the index was read from FMG, the tool's own changes do not make the rest of it any more current.
+    def save_index(self, index):
+        current = dict(index.sn_by_name)
+        with self._lock:
+            removed = [(name,) for name in self._saved if name not in current]
+            changed = [(name, sn) for name, sn in current.items() if name not in self._saved or self._saved[name] != sn]
+            self._execute([('DELETE FROM devices WHERE name = ?', removed),
+                           ('INSERT OR REPLACE INTO devices (name, sn) VALUES (?, ?)', changed),
+                           ('INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)',
+                            [('dvm_read', str(self.dvm_read))])], many=True)
+            self._saved = current
+            self.dvm_changes = len(removed) + len(changed)
+
+    # (path, params, (code, msg), fetched time) of every stored object read less than max_age seconds ago
+    def objects(self):
+        oldest = time.time() - self.max_age
+        with self._lock:
+            rows = self._conn.execute('SELECT path, params, code, msg, fetched FROM objects WHERE fetched >= ?',
+                                      (oldest,)).fetchall()
+        return [(path, params, (code, json.loads(msg)), fetched) for path, params, code, msg, fetched in rows]
+
+    def put_object(self, path, params, result):
+        code, msg = result
+        with self._lock:
+            self._execute([('INSERT OR REPLACE INTO objects (path, params, code, msg, fetched) VALUES (?, ?, ?, ?, ?)',
+                            (path, params, code, json.dumps(msg, default=str), time.time()))])
+
+    # Drop the stored objects with the passed in (path, params) keys, or every object with no keys
+    def forget_objects(self, keys=None):
+        if self.dry_run:
+            return
+        with self._lock:
+            if keys is None:
+                self._execute([('DELETE FROM objects', ())])
+            else:
+                self._execute([('DELETE FROM objects WHERE path = ? AND params = ?', list(keys))], many=True)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    # Run the statements in one transaction, with many=True each one with a list of parameter tuples
+    def _execute(self, statements, many=False):
+        self._conn.execute('BEGIN')
+        try:
+            for sql, params in statements:
+                if many:
+                    self._conn.executemany(sql, params)
+                else:
+                    self._conn.execute(sql, params)
+        except Exception:
+            self._conn.execute('ROLLBACK')
+            raise
+        self._conn.execute('COMMIT')
@@ -0,0 +1,176 @@
+import threading
+import time
+from concurrent.futures import Future
+
+
+# Tracks many outstanding FMG tasks at once from a single background thread.  Instead of every caller running
+# pyFMG's blocking track_task() loop (one GET per task per poll), all outstanding task ids are polled together with
+# one filtered '/task/task' GET per batch, on an interval that shortens while tasks are progressing and backs off
+# while they are not.  Every newly submitted task is polled right away (together with whatever else is outstanding),
+# the interval only applies between later polls.  Like track_task() a task times out 'timeout' seconds after its FMG
+# start_tm.  Each task resolves a Future with the same (code, task_info) that track_task() returns.
+class TaskTracker:
+    def __init__(self, fmg_api=None, min_interval: float = 1.0, max_interval: float = 10.0, batch_size: int = 100,
+                 timeout: int = 300, retrieval_fail_gate: int = 10):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.batch_size = batch_size
+        self.timeout = timeout
+        self.retrieval_fail_gate = retrieval_fail_gate
+        self.interval = min_interval
+        self.polls = 0
+        self._tasks = {}  # taskid -> [future, start time (submit time until FMG reports start_tm), last percent]
+        self._cond = threading.Condition()
+        self._thread = None
+        self._stopped = False
+        self._poll_now = False
+        self._fail_count = 0
+        if fmg_api is not None: self.api = fmg_api
+
+    @property
+    def api(self):
+        return self._api
+
+    @api.setter
+    def api(self, myapi):
+        self._api = myapi
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def start(self):
+        if self._thread is None:
+            self._stopped = False
+            self._thread = threading.Thread(target=self._run, name='fmg-task-tracker', daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    # Number of tasks submitted and not yet resolved
+    @property
+    def outstanding(self):
+        with self._cond:
+            return len(self._tasks)
+
+    # Start tracking a task id.  Returns a Future resolving to (code, task_info), callback (if passed) is called
+    # with the Future once the task is done.
+    def submit(self, taskid, callback=None):
+        with self._cond:
+            if taskid in self._tasks:
+                future = self._tasks[taskid][0]
+            else:
+                future = Future()
+                self._tasks[taskid] = [future, time.time(), 0]
+            # New work, poll it right away and at the shortest interval after that.  Submissions arriving while a poll
+            # is being sent share the next one.
+            self.interval = self.min_interval
+            self._poll_now = True
+            self._cond.notify_all()
+        if callback is not None:
+            future.add_done_callback(callback)
+        self.start()
+        return future
+
+    # Drop-in for pyFMG's blocking api.track_task(), the wait happens on the Future instead of a polling loop
+    def track_task(self, task_id, **kwargs):
+        return self.submit(task_id).result()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._tasks and not self._stopped:
+                    self._cond.wait()
+                if self._stopped:
+                    pending = list(self._tasks.values())
+                    self._tasks.clear()
+                    break
+                if not self._poll_now:
+                    self._cond.wait(self.interval)
+                self._poll_now = False
+                taskids = list(self._tasks)
+
+            progressed = False
+            for i in range(0, len(taskids), self.batch_size):
+                progressed |= self._poll(taskids[i:i + self.batch_size])
+
+            with self._cond:
+                if progressed:
+                    self.interval = self.min_interval
+                else:
+                    self.interval = min(self.interval * 1.5, self.max_interval)
+
+        for future, started, percent in pending:
+            future.set_result((1, {'msg': 'Task tracker stopped before task completed'}))
+
+    # Poll a batch of task ids with one request, resolve the finished ones.  Returns True if any task progressed.
+    def _poll(self, taskids):
+        self.polls += 1
+        url = '/task/task'
+        data = {
+            'filter': [['id', 'in', *taskids]],
+            'fields': ['id', 'percent', 'num_err', 'num_warn', 'state', 'start_tm']
+        }
+        try:
+            code, tasks = self.api.get(url, data)
+        except Exception as e:
+            code, tasks = 1, str(e)
+
+        if code != 0:
+            self._fail_count += 1
+            if self._fail_count >= self.retrieval_fail_gate:
+                msg = f'Task info retrieval failed over {self.retrieval_fail_gate} times: {tasks}'
+                for taskid in taskids:
+                    self._resolve(taskid, (code, {'msg': msg}))
+            return False
+        self._fail_count = 0
+
+        if isinstance(tasks, dict):
+            tasks = [tasks]
+
+        progressed = False
+        for task in tasks or []:
+            taskid = task.get('id')
+            with self._cond:
+                entry = self._tasks.get(taskid)
+            if entry is None:
+                continue
+            if task.get('start_tm'):
+                entry[1] = int(task['start_tm'])
+            percent = int(task.get('percent', 0))
+            if percent != entry[2]:
+                entry[2] = percent
+                progressed = True
+            if percent == 100:
+                # The list query does not carry the task lines, fetch the full task record once it is done
+                try:
+                    result = self.api.get(f'/task/task/{taskid}')
+                except Exception as e:
+                    result = (1, {'msg': str(e)})
+                self._resolve(taskid, result)
+
+        # Give up on tasks that have run too long (or that FMG no longer returns)
+        now = time.time()
+        for taskid in taskids:
+            with self._cond:
+                entry = self._tasks.get(taskid)
+            if entry is not None and now - entry[1] >= self.timeout:
+                msg = f'Task {taskid} did not complete in efficient time and timed out. ' \
+                      f'The timeout value was {self.timeout}.'
+                self._resolve(taskid, (1, {'msg': msg}))
+        return progressed
+
+    def _resolve(self, taskid, result):
+        with self._cond:
+            entry = self._tasks.pop(taskid, None)
+        if entry is not None:
+            entry[0].set_result(result)
@@ -0,0 +1,147 @@
+import csv
+import json
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+
+# Per device, per pipeline step timing.  Each step run is recorded with its wall time, the number of FMG API calls
+# made while it ran and the time spent waiting on FMG tasks.  The API calls and task waits are picked up from the
+# TimedApi wrapper below, for whichever step is running on the calling thread.
+class StepTimer:
+    FIELDS = ('device', 'step', 'ok', 'wall', 'requests', 'request_time', 'task_waits', 'task_wait')
+
+    def __init__(self):
+        self.records = []
+        self.unattributed_requests = 0  # calls made outside of any step (task tracker polls etc.)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    # Time one step of one device.  Yields the record, set record['ok'] to False for a failed step.
+    @contextmanager
+    def step(self, device, step):
+        record = {'device': device, 'step': step, 'ok': True, 'wall': 0.0, 'requests': 0, 'request_time': 0.0,
+                  'task_waits': 0, 'task_wait': 0.0}
+        outer = getattr(self._local, 'record', None)
+        self._local.record = record
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record['wall'] = time.perf_counter() - start
+            self._local.record = outer
+            with self._lock:
+                self.records.append(record)
+
+    # Record of the step running on the calling thread, None outside of any step
+    def current(self):
+        return getattr(self._local, 'record', None)
+
+    @contextmanager
+    def request(self):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            record = getattr(self._local, 'record', None)
+            if record is None:
+                with self._lock:
+                    self.unattributed_requests += 1
+            else:
+                record['requests'] += 1
+                record['request_time'] += time.perf_counter() - start
+
+    @contextmanager
+    def task_wait(self):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            record = getattr(self._local, 'record', None)
+            if record is not None:
+                record['task_waits'] += 1
+                record['task_wait'] += time.perf_counter() - start
+
+    # Summary table of p50/p95/max wall time per step (and for the whole pipeline per device)
+    def summary(self):
+        by_step = {}
+        by_device = {}
+        for rec in self.records:
+            by_step.setdefault(rec['step'], []).append(rec)
+            by_device.setdefault(rec['device'], 0.0)
+            by_device[rec['device']] += rec['wall']
+
+        lines = [f'  {"step":<26} {"runs":>6} {"p50":>8} {"p95":>8} {"max":>8} {"calls/run":>10} {"task wait p50":>14}']
+        for step, recs in by_step.items():
+            walls = sorted(r['wall'] for r in recs)
+            waits = sorted(r['task_wait'] for r in recs)
+            calls = sum(r['requests'] for r in recs) / len(recs)
+            lines.append(f'  {step:<26} {len(recs):>6} {percentile(walls, 50):>8.3f} {percentile(walls, 95):>8.3f} '
+                         f'{walls[-1]:>8.3f} {calls:>10.1f} {percentile(waits, 50):>14.3f}')
+        if by_device:
+            totals = sorted(by_device.values())
+            lines.append(f'  {"(per device total)":<26} {len(totals):>6} {percentile(totals, 50):>8.3f} '
+                         f'{percentile(totals, 95):>8.3f} {totals[-1]:>8.3f}')
+        requests = sum(r['requests'] for r in self.records)
+        lines.append(f'  API calls: {requests} in steps, {self.unattributed_requests} outside of steps')
+        return '\n'.join(lines)
+
+    # Write the raw per step records, as CSV if the path ends with .csv otherwise as JSON
+    def write(self, path):
+        with open(path, 'w', newline='') as f:
+            if path.lower().endswith('.csv'):
+                writer = csv.DictWriter(f, fieldnames=self.FIELDS)
+                writer.writeheader()
+                writer.writerows(self.records)
+            else:
+                json.dump(self.records, f, indent=2)
+
+
+# Nearest-rank percentile of an already sorted list
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    rank = max(math.ceil(pct / 100.0 * len(values)) - 1, 0)
+    return values[min(rank, len(values) - 1)]
+
+
+# Wraps a FortiManager api object (or a TaskTracker) and reports every API call and task wait to a StepTimer.
+# Anything else is passed straight through, so it can be used anywhere the wrapped object is.
+class TimedApi:
+    def __init__(self, fmg_api, timer: StepTimer):
+        self.api = fmg_api
+        self.timer = timer
+
+    def __getattr__(self, name):
+        return getattr(self.api, name)
+
+    def _request(self, method, url, *args, **kwargs):
+        with self.timer.request():
+            return getattr(self.api, method)(url, *args, **kwargs)
+
+    def get(self, url, *args, **kwargs):
+        return self._request('get', url, *args, **kwargs)
+
+    def add(self, url, *args, **kwargs):
+        return self._request('add', url, *args, **kwargs)
+
+    def set(self, url, *args, **kwargs):
+        return self._request('set', url, *args, **kwargs)
+
+    def update(self, url, *args, **kwargs):
+        return self._request('update', url, *args, **kwargs)
+
+    def delete(self, url, *args, **kwargs):
+        return self._request('delete', url, *args, **kwargs)
+
+    def execute(self, url, *args, **kwargs):
+        return self._request('execute', url, *args, **kwargs)
+
+    def free_form(self, method, **kwargs):
+        with self.timer.request():
+            return self.api.free_form(method, **kwargs)
+
+    def track_task(self, task_id, **kwargs):
+        with self.timer.task_wait():
+            return self.api.track_task(task_id, **kwargs)
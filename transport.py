@@ -0,0 +1,86 @@
+import random
+import socket
+import time
+from pyFMG.fortimgr import FMGBaseException, FMGConnectionError, FMGValidSessionException
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection
+from urllib3.util.retry import Retry
+
+
+# requests HTTPAdapter for the pyFMG session: a connection pool sized for the number of concurrent callers (callers
+# wait for a free connection rather than opening one that is thrown away after the request), TCP keep-alive on the
+# pooled connections so idle ones are not dropped by firewalls/NAT between runs of requests, and retry of failed
+# connection attempts only (the request has not been sent yet, so this is safe for every JSON-RPC method).
+class PooledAdapter(HTTPAdapter):
+    def __init__(self, pool_size: int = 10, connect_retries: int = 3, backoff: float = 0.5):
+        self._socket_options = HTTPConnection.default_socket_options + [(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)]
+        retry = Retry(total=None, connect=connect_retries, read=0, redirect=0, status=0, other=0,
+                      backoff_factor=backoff, backoff_jitter=backoff)
+        super().__init__(pool_connections=1, pool_maxsize=pool_size, pool_block=True, max_retries=retry)
+
+    def init_poolmanager(self, *args, **kwargs):
+        kwargs['socket_options'] = self._socket_options
+        super().init_poolmanager(*args, **kwargs)
+
+    # (connections opened, requests sent) across the pools of this adapter
+    def counters(self):
+        opened = 0
+        requests = 0
+        pools = self.poolmanager.pools
+        for key in pools.keys():
+            pool = pools[key]
+            opened += pool.num_connections
+            requests += pool.num_requests
+        return opened, requests
+
+
+# Transport settings for a pyFMG FortiManager object, and an api wrapper that can be passed anywhere the
+# FortiManager 'api' is expected.  Mounts a PooledAdapter on the FortiManager's requests session (do this before
+# login so the login uses it too) and retries get() calls that fail with a connection error, with exponential backoff
+# and full jitter.  Only reads are retried: a write that timed out may still have been applied by FMG.
+class FmgTransport:
+    def __init__(self, fmg_api, pool_size: int = 10, get_retries: int = 3, backoff: float = 0.5,
+                 backoff_max: float = 10.0):
+        self.api = fmg_api
+        self.get_retries = get_retries
+        self.backoff = backoff
+        self.backoff_max = backoff_max
+        self.retries = 0
+        self.adapter = PooledAdapter(pool_size, get_retries, backoff)
+        fmg_api.sess.mount('https://', self.adapter)
+        fmg_api.sess.mount('http://', self.adapter)
+
+    def __getattr__(self, name):
+        return getattr(self.api, name)
+
+    @property
+    def connections_opened(self):
+        return self.adapter.counters()[0]
+
+    # Requests sent over an already open connection (no TCP connect or TLS handshake)
+    @property
+    def connections_reused(self):
+        opened, requests = self.adapter.counters()
+        return max(requests - opened, 0)
+
+    def get(self, url, *args, **kwargs):
+        return self._read(self.api.get, url, *args, **kwargs)
+
+    def free_form(self, method, **kwargs):
+        if method == 'get':
+            return self._read(self.api.free_form, method, **kwargs)
+        return self.api.free_form(method, **kwargs)
+
+    def _read(self, func, *args, **kwargs):
+        attempt = 0
+        while True:
+            try:
+                return func(*args, **kwargs)
+            except FMGValidSessionException:
+                raise
+            except (FMGConnectionError, FMGBaseException):
+                if attempt >= self.get_retries:
+                    raise
+            time.sleep(random.uniform(0, min(self.backoff_max, self.backoff * 2 ** attempt)))
+            attempt += 1
+            self.retries += 1